@@ -1,10 +1,18 @@
 # ai_agents.py
+import os
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from PIL import Image
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.neighbors import NearestNeighbors
+from sklearn.decomposition import TruncatedSVD
 from transformers import CLIPModel, CLIPProcessor
 import faiss
 import torch
@@ -81,45 +89,614 @@ df = pd.DataFrame(interactions_data, columns=['user_id', 'product_id', 'score'])
 
 # 2. Create a user-item matrix
 user_item_matrix = df.pivot(index='user_id', columns='product_id', values='score').fillna(0)
+# Backing array of user_item_matrix. Both the frame and the neighbour model
+# are views of it, so incremental updates write scores in place.
+_matrix_buffer = user_item_matrix.to_numpy(copy=True)
+user_item_matrix = pd.DataFrame(_matrix_buffer, index=user_item_matrix.index,
+                                columns=user_item_matrix.columns, copy=False)
 
 # 3. Configure the model to find similar users
 # We use cosine similarity to find users who rated items similarly
 user_similarity_model = NearestNeighbors(metric='cosine', algorithm='brute')
-user_similarity_model.fit(user_item_matrix.values)
+user_similarity_model.fit(_matrix_buffer)
 # --- End of model training ---
 
+def _find_similar_users(user_id, n_neighbors=3):
+    """Returns the ids of the users most similar to `user_id`."""
+    ann = user_ann
+    if ann is not None:
+        pos = user_item_matrix.index.get_loc(user_id)
+        query = _ann_vectors(ann, user_item_matrix.values[pos:pos + 1])
+        # efSearch was left at the tuned value by build_user_ann_index
+        with ann["lock"].reading():
+            _, indices = ann["index"].search(query, n_neighbors)
+        neighbours = [i for i in indices[0] if i >= 0 and i != pos][:n_neighbors - 1]
+        return [user_item_matrix.index[i] for i in neighbours]
+
+    # The nearest neighbour is the user themselves, so ask for one extra
+    distances, indices = user_similarity_model.kneighbors(
+        user_item_matrix.loc[user_id].values.reshape(1, -1),
+        n_neighbors=n_neighbors
+    )
+    return [user_item_matrix.index[i] for i in indices.flatten()[1:]]
+
+
+def _recommend_from_neighbours(user_id, neighbours):
+    """Collects products the neighbours liked that the user hasn't seen."""
+    recommendations = set()
+    for similar_user_id in neighbours:
+        # Get products the similar user interacted with strongly (score > 3)
+        liked_products = user_item_matrix.loc[similar_user_id]
+        liked_products = liked_products[liked_products > 3].index.tolist()
+        recommendations.update(liked_products)
+
+    # Filter out items the original user has already seen
+    seen_products = user_item_matrix.loc[user_id]
+    seen_products = seen_products[seen_products > 0].index.tolist()
+    return list(recommendations - set(seen_products))
+
+
 def get_recommendations(user_id):
     """
     Finds users similar to the given user and recommends products
     they liked.
     """
     try:
-        # Find the 3 most similar users (including the user themselves)
-        distances, indices = user_similarity_model.kneighbors(
-            user_item_matrix.loc[user_id].values.reshape(1, -1),
-            n_neighbors=3
-        )
-
-        recommendations = set()
-        # Get items from similar users
-        for i in range(1, len(indices.flatten())):
-            similar_user_id = user_item_matrix.index[indices.flatten()[i]]
-            # Get products the similar user interacted with strongly (score > 3)
-            liked_products = user_item_matrix.loc[similar_user_id]
-            liked_products = liked_products[liked_products > 3].index.tolist()
-            recommendations.update(liked_products)
-
-        # Filter out items the original user has already seen
-        seen_products = user_item_matrix.loc[user_id]
-        seen_products = seen_products[seen_products > 0].index.tolist()
-        final_recs = list(recommendations - set(seen_products))
-
-        return {"user_id": user_id, "recommended_product_ids": final_recs}
+        entry = _recommendation_cache.get(user_id) or _cache_recommendations(user_id)
+        return {"user_id": user_id, "recommended_product_ids": entry[1]}
     except KeyError:
         return {"error": "User ID not found or has no interactions"}, 404
     except Exception as e:
         return {"error": str(e)}, 500
-    
+
+
+# --- Incremental updates ---
+# New interactions are written into the user-item matrix as they arrive
+# instead of rebuilding it from scratch: in place when they only touch
+# known users and products, with one copy when the matrix has to grow.
+# Cached recommendations are refreshed only for the users whose rows
+# changed and the users whose cached neighbours include them.
+
+RECOMMENDATION_CACHE_SIZE = int(os.getenv('RECOMMENDATION_CACHE_SIZE', '100000'))
+# user_id -> (neighbour ids, recommended product ids), oldest first
+_recommendation_cache = OrderedDict()
+_update_lock = threading.Lock()
+_update_seq = 0
+interactions_watermark = None
+
+
+def _cache_recommendations(user_id):
+    neighbours = _find_similar_users(user_id)
+    entry = (neighbours, _recommend_from_neighbours(user_id, neighbours))
+    _recommendation_cache[user_id] = entry
+    while len(_recommendation_cache) > RECOMMENDATION_CACHE_SIZE:
+        try:
+            _recommendation_cache.popitem(last=False)
+        except KeyError:
+            break
+    return entry
+
+
+def _seen_product_ids(user_id):
+    """Products the user has interacted with, from the user-item matrix."""
+    if user_id not in user_item_matrix.index:
+        return []
+    row = user_item_matrix.loc[user_id]
+    return row[row > 0].index.tolist()
+
+
+def apply_new_interactions(new_interactions):
+    """
+    Applies (user_id, product_id, score, timestamp) rows and refreshes the
+    affected cached users. A pair's score only goes up, so a later cart add
+    doesn't undo a purchase and rows seen before change nothing. Returns
+    the ids of the users whose recommendations were refreshed.
+    """
+    global user_item_matrix, _matrix_buffer, interactions_watermark, _update_seq
+
+    with _update_lock:
+        if new_interactions.empty:
+            return []
+        latest = new_interactions.groupby(['user_id', 'product_id'], as_index=False) \
+            .agg(score=('score', 'max'), timestamp=('timestamp', 'max'))
+
+        index, columns = user_item_matrix.index, user_item_matrix.columns
+        new_users = pd.Index(latest['user_id'].unique()).difference(index, sort=False)
+        new_items = pd.Index(latest['product_id'].unique()).difference(columns, sort=False)
+        n_users = len(index) + len(new_users)
+        if len(new_items) or n_users > len(_matrix_buffer):
+            # Rows get spare capacity so most batches of new users fit
+            # without a copy; new products change the width, which needs one
+            capacity = max(n_users, 2 * len(_matrix_buffer)) if n_users > len(_matrix_buffer) else len(_matrix_buffer)
+            grown = np.zeros((capacity, len(columns) + len(new_items)))
+            grown[:len(index), :len(columns)] = _matrix_buffer[:len(index)]
+            _matrix_buffer = grown
+        if len(new_users) or len(new_items):
+            index, columns = index.append(new_users), columns.append(new_items)
+            user_item_matrix = pd.DataFrame(_matrix_buffer[:n_users], index=index, columns=columns, copy=False)
+            # Brute-force fitting only keeps a reference to the array
+            user_similarity_model.fit(_matrix_buffer[:n_users])
+
+        rows, cols = index.get_indexer(latest['user_id']), columns.get_indexer(latest['product_id'])
+        current = _matrix_buffer[rows, cols]
+        raised = latest['score'].values > current
+        _matrix_buffer[rows, cols] = np.maximum(current, latest['score'].values)
+        if interactions_watermark is None or latest['timestamp'].max() > interactions_watermark:
+            interactions_watermark = latest['timestamp'].max()
+        if not raised.any():
+            return []  # only rows already applied, e.g. the feed's overlap window
+        changed = set(latest['user_id'][raised])
+
+        _update_seq += 1
+        if user_ann is not None:
+            _extend_user_ann(user_ann, user_item_matrix.values, index.get_indexer(list(changed)), _update_seq)
+            if _user_ann_drift(user_ann, user_item_matrix.shape[1]) > USER_ANN_REBUILD_DRIFT or \
+                    time.time() - user_ann["built_at"] > USER_ANN_REBUILD_SECONDS:
+                _rebuild_user_ann_in_background()
+
+        # Users without a cached entry are computed on their next request
+        affected = set()
+        for user_id, (neighbours, _) in list(_recommendation_cache.items()):
+            if user_id in changed or changed.intersection(neighbours):
+                affected.add(user_id)
+                if user_id in changed:
+                    affected.update(n for n in neighbours if n in _recommendation_cache)
+
+        for user_id in affected:
+            _cache_recommendations(user_id)
+        return sorted(int(u) for u in affected)
+
+
+# --- Interaction feed ---
+# Orders and cart adds reach the recommender through a polling thread in
+# each serving process: it asks the app for rows newer than
+# interactions_watermark (all of them on the first poll) and applies them.
+# Timestamps are set before commit, so a transaction can commit after a
+# poll with an earlier timestamp. Each poll therefore re-reads
+# INTERACTIONS_OVERLAP_SECONDS before the watermark; applying a row twice
+# is harmless because scores only go up.
+
+PURCHASE_SCORE = 5
+CART_SCORE = 2
+INTERACTIONS_POLL_SECONDS = int(os.getenv('INTERACTIONS_POLL_SECONDS', '60'))
+INTERACTIONS_OVERLAP_SECONDS = int(os.getenv('INTERACTIONS_OVERLAP_SECONDS', '300'))
+_consumer_lock = threading.Lock()
+_consumer_thread = None
+
+
+def start_interactions_consumer(fetch_since, interval=INTERACTIONS_POLL_SECONDS):
+    """
+    Starts the polling thread once per process. `fetch_since(since)`
+    returns (user_id, product_id, score, timestamp) rows newer than
+    `since` (None means everything).
+    """
+    global _consumer_thread
+
+    def poll():
+        while True:
+            try:
+                since = interactions_watermark
+                if since is not None:
+                    since = (pd.Timestamp(since) - pd.Timedelta(seconds=INTERACTIONS_OVERLAP_SECONDS)).to_pydatetime()
+                rows = fetch_since(since)
+                if rows:
+                    apply_new_interactions(pd.DataFrame(rows, columns=['user_id', 'product_id', 'score', 'timestamp']))
+            except Exception:
+                # Keep serving the current model; the next poll retries
+                logging.getLogger(__name__).exception('applying new interactions failed')
+            time.sleep(interval)
+
+    with _consumer_lock:
+        if _consumer_thread is None:
+            _consumer_thread = threading.Thread(target=poll, name='interactions-consumer', daemon=True)
+            _consumer_thread.start()
+
+
+# --- Approximate user neighbour search ---
+# Exact brute-force cosine compares the query against every user. With
+# USER_ANN_BACKEND=hnsw the neighbour lookup goes through a FAISS HNSW
+# graph over L2-normalized (optionally SVD-reduced) user vectors, where the
+# inner product equals cosine similarity. efSearch is picked as the smallest
+# value that reaches USER_ANN_RECALL_TARGET against the exact result.
+
+USER_ANN_BACKEND = os.getenv('USER_ANN_BACKEND', 'exact')
+USER_ANN_RECALL_TARGET = float(os.getenv('USER_ANN_RECALL_TARGET', '0.95'))
+USER_ANN_SVD_DIM = int(os.getenv('USER_ANN_SVD_DIM', '0'))  # 0 keeps the full vectors
+# Incremental updates append new users to the graph; changed users keep
+# their old vector until a rebuild, which runs in the background once this
+# share of the graph is stale (or new products have appeared), or once the
+# graph is older than USER_ANN_REBUILD_SECONDS.
+USER_ANN_REBUILD_DRIFT = float(os.getenv('USER_ANN_REBUILD_DRIFT', '0.1'))
+USER_ANN_REBUILD_SECONDS = int(os.getenv('USER_ANN_REBUILD_SECONDS', '86400'))
+EF_SEARCH_CANDIDATES = [16, 32, 64, 128, 256, 512, 1024]
+
+
+def _user_vectors(matrix, svd=None):
+    """Projects user rows for the ANN index and L2-normalizes them."""
+    vectors = svd.transform(matrix) if svd is not None else matrix
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _exact_neighbours(matrix, queries, k):
+    """Exact cosine neighbours, the ground truth for recall."""
+    vectors = _user_vectors(matrix)
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    return index.search(vectors[queries], k)[1]
+
+
+def _recall(approx, exact):
+    hits = sum(len(set(a) & set(e)) for a, e in zip(approx, exact))
+    return hits / exact.size
+
+
+class _ReadWriteLock:
+    """
+    Any number of readers or a single writer. FAISS indexes can be searched
+    concurrently but not while they are being added to. A waiting writer
+    blocks new readers so a steady stream of searches can't starve it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def reading(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+def build_user_ann_index(matrix, recall_target=USER_ANN_RECALL_TARGET, svd_dim=USER_ANN_SVD_DIM,
+                         M=32, k=10, sample_size=200, seed=42):
+    """
+    Builds an HNSW index over the user rows of `matrix` and tunes efSearch
+    on a sample of users until recall@k reaches `recall_target`.
+    """
+    svd = None
+    if svd_dim and svd_dim < matrix.shape[1]:
+        svd = TruncatedSVD(n_components=svd_dim, random_state=seed).fit(matrix)
+    vectors = _user_vectors(matrix, svd)
+
+    index = faiss.IndexHNSWFlat(vectors.shape[1], M, faiss.METRIC_INNER_PRODUCT)
+    index.add(vectors)
+
+    k = min(k, len(vectors))
+    queries = np.random.default_rng(seed).choice(len(vectors), min(sample_size, len(vectors)), replace=False)
+    exact = _exact_neighbours(matrix, queries, k)
+    for ef_search in EF_SEARCH_CANDIDATES:
+        index.hnsw.efSearch = ef_search
+        recall = _recall(index.search(vectors[queries], k)[1], exact)
+        if recall >= recall_target:
+            break
+    return {"index": index, "svd": svd, "ef_search": ef_search, "recall": recall,
+            "n_items": matrix.shape[1], "built_at": time.time(), "stale": {}, "lock": _ReadWriteLock()}
+
+
+def _ann_vectors(ann, rows):
+    """Vectors for user rows in the space `ann` was built in (its product columns)."""
+    return _user_vectors(rows[:, :ann["n_items"]], ann["svd"])
+
+
+def _extend_user_ann(ann, matrix, changed_positions, seq):
+    """Adds users appended to `matrix` since the last call and notes which indexed users went stale."""
+    indexed = ann["index"].ntotal
+    for pos in changed_positions:
+        if pos < indexed:
+            ann["stale"][pos] = seq
+    if len(matrix) > indexed:
+        vectors = _ann_vectors(ann, matrix[indexed:])
+        with ann["lock"].writing():
+            ann["index"].add(vectors)
+
+
+def _user_ann_drift(ann, n_items):
+    return len(ann["stale"]) / max(ann["index"].ntotal, 1) + (n_items - ann["n_items"]) / max(ann["n_items"], 1)
+
+
+_ann_rebuild_lock = threading.Lock()
+
+
+def _rebuild_user_ann_in_background():
+    """Rebuilds the graph from a snapshot without holding _update_lock, then swaps it in."""
+    if not _ann_rebuild_lock.acquire(blocking=False):
+        return  # a rebuild is already running
+
+    def rebuild():
+        global user_ann
+        try:
+            with _update_lock:
+                matrix = user_item_matrix.to_numpy(copy=True)
+                seq = _update_seq
+            ann = build_user_ann_index(matrix)
+            with _update_lock:
+                # Catch up with the batches applied while building
+                ann["stale"] = {pos: s for pos, s in user_ann["stale"].items() if s > seq and pos < len(matrix)}
+                _extend_user_ann(ann, user_item_matrix.values, [], seq)
+                user_ann = ann
+        finally:
+            _ann_rebuild_lock.release()
+
+    threading.Thread(target=rebuild, name='user-ann-rebuild', daemon=True).start()
+
+
+def benchmark_user_ann(matrix, k=10, n_queries=1000, seed=42, **index_kwargs):
+    """
+    Compares the HNSW backend against the exact brute-force cosine search
+    used by user_similarity_model. Returns build time, per-query latency
+    for both and the measured recall@k.
+    """
+    queries = np.random.default_rng(seed).choice(len(matrix), min(n_queries, len(matrix)), replace=False)
+
+    exact_model = NearestNeighbors(metric='cosine', algorithm='brute').fit(matrix)
+    started = time.perf_counter()
+    exact = exact_model.kneighbors(matrix[queries], n_neighbors=k, return_distance=False)
+    exact_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    started = time.perf_counter()
+    ann = build_user_ann_index(matrix, k=k, seed=seed, **index_kwargs)
+    build_s = time.perf_counter() - started
+
+    vectors = _ann_vectors(ann, matrix[queries])
+    ann["index"].hnsw.efSearch = ann["ef_search"]
+    started = time.perf_counter()
+    approx = ann["index"].search(vectors, k)[1]
+    ann_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    return {
+        "users": len(matrix),
+        "ef_search": ann["ef_search"],
+        "build_seconds": round(build_s, 3),
+        "exact_ms_per_query": round(exact_ms, 4),
+        "ann_ms_per_query": round(ann_ms, 4),
+        "recall_at_k": round(_recall(approx, exact), 4),
+    }
+
+
+user_ann = build_user_ann_index(user_item_matrix.values) if USER_ANN_BACKEND == 'hnsw' else None
+# --- End of user ANN index ---
+
+
+# --- Item-item collaborative filtering ---
+# Similarity is computed between products that show up together in the same
+# order or cart. Each product only keeps its top-k neighbours, so the table
+# stays small and only needs rebuilding when the catalog changes noticeably.
+# The table is built offline (see train_item_similarity.py) and loaded here.
+
+ITEM_SIMILARITY_DIR = os.getenv('ITEM_SIMILARITY_DIR', 'item_similarity')
+
+def build_item_similarity(interactions, top_k=20, chunk_size=1024):
+    """
+    Builds a sparse top-k item-item cosine similarity table.
+
+    `interactions` has `user_id`, `product_id` and `score` columns. The
+    `user_id` can be any basket key (a user, an order or a cart), so
+    co-purchase and co-cart data can be combined before calling this.
+    The item-item product is computed `chunk_size` items at a time, so
+    memory stays bounded by chunk_size * n_items instead of n_items ** 2.
+    """
+    users = pd.Index(interactions['user_id'].unique())
+    items = pd.Index(interactions['product_id'].unique())
+    X = sparse.csr_matrix(
+        (interactions['score'].astype(np.float32).values,
+         (users.get_indexer(interactions['user_id']),
+          items.get_indexer(interactions['product_id']))),
+        shape=(len(users), len(items))
+    )
+    # L2-normalize columns so the dot product is the cosine similarity
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=0))).ravel()
+    norms[norms == 0] = 1.0
+    X = (X @ sparse.diags(1.0 / norms)).tocsr()
+    Xt = X.T.tocsr()
+
+    rows, cols, vals = [], [], []
+    for start in range(0, len(items), chunk_size):
+        block = (Xt[start:start + chunk_size] @ X).tocsr()
+        for r in range(block.shape[0]):
+            lo, hi = block.indptr[r], block.indptr[r + 1]
+            row_cols, row_vals = block.indices[lo:hi], block.data[lo:hi]
+            # Drop the item's similarity to itself
+            other = row_cols != start + r
+            row_cols, row_vals = row_cols[other], row_vals[other]
+            if len(row_vals) > top_k:
+                keep = np.argpartition(-row_vals, top_k)[:top_k]
+                row_cols, row_vals = row_cols[keep], row_vals[keep]
+            rows.extend([start + r] * len(row_vals))
+            cols.extend(row_cols)
+            vals.extend(row_vals)
+
+    similarity = sparse.csr_matrix(
+        (np.asarray(vals, dtype=np.float32), (rows, cols)),
+        shape=(len(items), len(items))
+    )
+    return {"product_ids": items, "similarity": similarity}
+
+
+def get_item_recommendations(user_id, recent_product_ids=None, top_n=10):
+    """
+    Recommends products by summing the neighbour lists of the user's
+    recent items. Falls back to the user's known interactions when no
+    recent items are given.
+    """
+    try:
+        product_ids = item_similarity["product_ids"]
+        if recent_product_ids is None:
+            recent_product_ids = _seen_product_ids(user_id)
+        positions = product_ids.get_indexer(recent_product_ids)
+        positions = positions[positions >= 0]
+        if len(positions) == 0:
+            return {"error": "User ID not found or has no interactions"}, 404
+
+        scores = np.asarray(item_similarity["similarity"][positions].sum(axis=0)).ravel()
+        scores[positions] = 0  # don't recommend what the user just looked at
+        candidates = np.flatnonzero(scores > 0)
+        ranked = candidates[np.argsort(-scores[candidates], kind='stable')][:top_n]
+        return {"user_id": user_id, "recommended_product_ids": product_ids[ranked].tolist()}
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+def save_item_similarity(table, path=ITEM_SIMILARITY_DIR):
+    """Writes the product ids as .npy and the similarity matrix as .npz."""
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'product_ids.npy'), np.asarray(table["product_ids"], dtype=np.int64))
+    sparse.save_npz(os.path.join(path, 'similarity.npz'), table["similarity"])
+
+
+def load_item_similarity(path=ITEM_SIMILARITY_DIR):
+    return {
+        "product_ids": pd.Index(np.load(os.path.join(path, 'product_ids.npy'))),
+        "similarity": sparse.load_npz(os.path.join(path, 'similarity.npz')).tocsr(),
+    }
+
+
+interactions_df = df
+if os.path.exists(os.path.join(ITEM_SIMILARITY_DIR, 'similarity.npz')):
+    item_similarity = load_item_similarity()
+else:
+    # No offline table yet: build one from the sample interactions
+    item_similarity = build_item_similarity(interactions_df)
+# --- End of item similarity training ---
+
+
+# --- Implicit-feedback matrix factorization (ALS) ---
+# User and item factors are trained offline (see train_mf.py), saved as
+# float32 .npy files and memory-mapped here, so every worker shares the
+# same pages. Serving is one user vector lookup plus an inner-product
+# search over the item factors.
+
+MF_FACTORS_DIR = os.getenv('MF_FACTORS_DIR', 'mf_factors')
+
+
+def train_als(interactions, factors=32, regularization=0.1, alpha=40.0, iterations=15, seed=42):
+    """
+    Trains implicit ALS (Hu, Koren & Volinsky) on (user_id, product_id, score)
+    rows, treating scores as confidence rather than ratings.
+    """
+    users = pd.Index(interactions['user_id'].unique())
+    items = pd.Index(interactions['product_id'].unique())
+    confidence = sparse.csr_matrix(
+        (alpha * interactions['score'].astype(np.float64).values,
+         (users.get_indexer(interactions['user_id']),
+          items.get_indexer(interactions['product_id']))),
+        shape=(len(users), len(items))
+    )
+    rng = np.random.default_rng(seed)
+    user_factors = rng.normal(scale=0.01, size=(len(users), factors))
+    item_factors = rng.normal(scale=0.01, size=(len(items), factors))
+
+    def solve(C, fixed):
+        # x_u = (Y^T Y + Y^T (C_u - I) Y + reg * I)^-1 Y^T C_u p_u
+        YtY = fixed.T @ fixed + regularization * np.eye(factors)
+        out = np.zeros((C.shape[0], factors))
+        for u in range(C.shape[0]):
+            lo, hi = C.indptr[u], C.indptr[u + 1]
+            idx, conf = C.indices[lo:hi], C.data[lo:hi]
+            if len(idx) == 0:
+                continue
+            Y = fixed[idx]
+            A = YtY + (Y.T * conf) @ Y
+            b = (Y.T * (1.0 + conf)).sum(axis=1)
+            out[u] = np.linalg.solve(A, b)
+        return out
+
+    confidence_t = confidence.T.tocsr()
+    for _ in range(iterations):
+        user_factors = solve(confidence, item_factors)
+        item_factors = solve(confidence_t, user_factors)
+
+    return {
+        "user_ids": users,
+        "product_ids": items,
+        "user_factors": user_factors.astype(np.float32),
+        "item_factors": item_factors.astype(np.float32),
+    }
+
+
+def save_factor_model(model, path=MF_FACTORS_DIR):
+    """Writes the factor matrices and id maps as .npy files."""
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'user_ids.npy'), np.asarray(model["user_ids"], dtype=np.int64))
+    np.save(os.path.join(path, 'product_ids.npy'), np.asarray(model["product_ids"], dtype=np.int64))
+    np.save(os.path.join(path, 'user_factors.npy'), np.ascontiguousarray(model["user_factors"], dtype=np.float32))
+    np.save(os.path.join(path, 'item_factors.npy'), np.ascontiguousarray(model["item_factors"], dtype=np.float32))
+
+
+def load_factor_model(path=MF_FACTORS_DIR):
+    """Loads a saved factor model with the factor matrices memory-mapped."""
+    return {
+        "user_ids": pd.Index(np.load(os.path.join(path, 'user_ids.npy'))),
+        "product_ids": pd.Index(np.load(os.path.join(path, 'product_ids.npy'))),
+        "user_factors": np.load(os.path.join(path, 'user_factors.npy'), mmap_mode='r'),
+        "item_factors": np.load(os.path.join(path, 'item_factors.npy'), mmap_mode='r'),
+    }
+
+
+def build_item_factor_index(item_factors):
+    """Builds a FAISS inner-product index over the item factors."""
+    index = faiss.IndexFlatIP(item_factors.shape[1])
+    index.add(np.ascontiguousarray(item_factors, dtype=np.float32))
+    return index
+
+
+def get_mf_recommendations(user_id, top_n=10):
+    """
+    Recommends products by searching the item factors for the largest
+    inner product with the user's factor vector.
+    """
+    try:
+        pos = mf_model["user_ids"].get_loc(user_id)
+        user_vector = np.asarray(mf_model["user_factors"][pos:pos + 1], dtype=np.float32)
+
+        seen = set(_seen_product_ids(user_id))
+        k = min(top_n + len(seen), MF_ITEM_INDEX.ntotal)
+        _, indices = MF_ITEM_INDEX.search(user_vector, k)
+
+        recs = [mf_model["product_ids"][i] for i in indices[0] if i >= 0]
+        recs = [int(p) for p in recs if p not in seen][:top_n]
+        return {"user_id": user_id, "recommended_product_ids": recs}
+    except KeyError:
+        return {"error": "User ID not found or has no interactions"}, 404
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+if os.path.exists(os.path.join(MF_FACTORS_DIR, 'item_factors.npy')):
+    mf_model = load_factor_model()
+else:
+    # No offline model yet: train on the sample interactions in memory
+    mf_model = train_als(interactions_df, factors=4)
+MF_ITEM_INDEX = build_item_factor_index(mf_model["item_factors"])
+# --- End of matrix factorization model ---
+
 # ai_agents.py
 # ... (imports from above)
 
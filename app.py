@@ -1,14 +1,35 @@
 import os
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, abort
+import io
+import csv
+import json
+import hashlib
+import sqlite3
+import random
+import time
+from functools import wraps
+from math import ceil
+from decimal import Decimal, InvalidOperation
+from datetime import datetime, timedelta, timezone
+from flask import Flask, request, jsonify, abort, stream_with_context, g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, func, insert, update, delete, select, literal
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only, joinedload
 from flask_migrate import Migrate
-from flask_bcrypt import Bcrypt
 from flask_jwt_extended import (
     JWTManager, create_access_token, create_refresh_token,
-    jwt_required, get_jwt_identity
+    jwt_required, get_jwt_identity, get_jwt, get_current_user, verify_jwt_in_request
 )
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
 from flask_cors import CORS
+from cache import ResponseCache, LRUCache, backend_from_env
+from serialization import json_response, response_body, stream_json
+from hashing import PasswordHasher, HashingBusy
+from ratelimit import RateLimited, limiter_from_env
 
 # ----------------------
 # Configuration
@@ -20,14 +41,97 @@ CORS(app)
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///ecofinds_dev.db')
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+def engine_options(url):
+    """Connection pool settings for `url`, overridable through DB_POOL_* variables."""
+    if url.startswith('sqlite'):
+        if url in ('sqlite://', 'sqlite:///:memory:'):
+            # In-memory databases use a single shared connection
+            return {}
+        # Writers queue on SQLite's lock anyway, so a big pool buys nothing
+        return {
+            'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.getenv('DB_POOL_MAX_OVERFLOW', 5)),
+            'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30))
+        }
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.getenv('DB_POOL_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+        # Recycle before server or proxy idle timeouts close connections
+        # under us, and check each one on checkout after a failover
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1') == '1'
+    }
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(DATABASE_URL)
+
+# Optional read replica; routes marked @read_only send their SELECTs to it
+DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL')
+if DATABASE_REPLICA_URL:
+    app.config['SQLALCHEMY_BINDS'] = {'replica': {'url': DATABASE_REPLICA_URL, **engine_options(DATABASE_REPLICA_URL)}}
+
+# SQLite pragmas, applied to every new connection
+SQLITE_PRAGMAS = {
+    # WAL lets readers keep going while a write (e.g. a SearchKeyword
+    # insert) is in progress
+    'journal_mode': 'WAL',
+    # Safe with WAL: a power loss can drop the last commits but never
+    # corrupts the database
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    # Negative means KiB, so -65536 is a 64 MiB page cache per connection
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', -65536)),
+    # Wait for a competing writer instead of failing with "database is locked"
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+}
+
+@event.listens_for(Engine, 'connect')
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'change-this-secret')
 # JWT expiry (example: 1 hour)
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
+# Refresh tokens renew sessions without a password (and a bcrypt check)
+app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=int(os.getenv('JWT_REFRESH_TOKEN_DAYS', 30)))
+# bcrypt cost factor; hashes with a different cost are upgraded on login
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+
+class RoutingSession(Session):
+    """
+    Sends plain SELECTs to the replica while a @read_only route has set
+    g.use_replica. Flushes and every other statement go to the primary, and
+    are noted in g.wrote_primary so the client can be kept on the primary
+    for a while afterwards.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            if self._flushing or not getattr(clause, 'is_select', False):
+                if getattr(mapper, 'class_', mapper) is not SearchKeyword:
+                    # Search analytics aren't anything the client reads back
+                    g.wrote_primary = True
+            elif g.get('use_replica'):
+                return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
 
 # Initialize extensions
-db = SQLAlchemy(app)
+# Objects stay loaded after commit, so write endpoints can serialize what
+# they just wrote without the session reloading every attribute first.
+db = SQLAlchemy(app, session_options={'expire_on_commit': False, 'class_': RoutingSession})
 migrate = Migrate(app, db)
-bcrypt = Bcrypt(app)
+# bcrypt runs in a bounded process pool so a login burst can't tie up
+# every request thread
+password_hasher = PasswordHasher(
+    rounds=app.config['BCRYPT_LOG_ROUNDS'],
+    workers=int(os.getenv('PASSWORD_HASH_WORKERS', 2)),
+    max_queue=int(os.getenv('PASSWORD_HASH_QUEUE', 32))
+)
 jwt = JWTManager(app)
 
 # ----------------------
@@ -37,7 +141,9 @@ class User(db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
+    # Stored lowercased (normalize_email); the unique index on lower(email)
+    # also catches mixed-case rows written before normalization
+    email = db.Column(db.String(120), nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -45,6 +151,10 @@ class User(db.Model):
     cart_items = db.relationship('CartItem', backref='user', lazy=True)
     orders = db.relationship('Order', backref='user', lazy=True)
 
+    __table_args__ = (
+        db.Index('uq_users_email_lower', func.lower(email), unique=True),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -66,35 +176,46 @@ class Category(db.Model):
 class Product(db.Model):
     __tablename__ = 'products'
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     title = db.Column(db.String(200), nullable=False, index=True)
     description = db.Column(db.Text)
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
     price = db.Column(db.Numeric(10, 2), nullable=False)
     image_url = db.Column(db.String(255), default='https://via.placeholder.com/300')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'title': self.title,
-            'description': self.description,
-            'category_id': self.category_id,
-            'price': float(self.price),
-            'image_url': self.image_url,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
+    # Category listings filter on category_id and sort newest first
+    __table_args__ = (db.Index('ix_products_category_created', 'category_id', 'created_at'),)
+
+    # One serializer per public field, so a sparse fieldset only touches
+    # the columns it asked for (and never lazy-loads a deferred one)
+    _serializers = {
+        'id': lambda p: p.id,
+        'user_id': lambda p: p.user_id,
+        'title': lambda p: p.title,
+        'description': lambda p: p.description,
+        'category_id': lambda p: p.category_id,
+        'price': lambda p: float(p.price),
+        'image_url': lambda p: p.image_url,
+        'created_at': lambda p: p.created_at.isoformat(),
+        'updated_at': lambda p: p.updated_at.isoformat() if p.updated_at else None
+    }
+
+    def to_dict(self, fields=None):
+        return {f: serialize(self) for f, serialize in self._serializers.items()
+                if fields is None or f in fields}
 
 class CartItem(db.Model):
     __tablename__ = 'cart'
+    # One row per (user, product); adding again bumps the quantity. The
+    # constraint's index also serves every lookup by user_id.
+    __table_args__ = (db.UniqueConstraint('user_id', 'product_id', name='uq_cart_user_product'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False, default=1)
-    added_at = db.Column(db.DateTime, default=datetime.utcnow)
+    added_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     product = db.relationship('Product')
 
@@ -111,9 +232,12 @@ class Order(db.Model):
     __tablename__ = 'orders'
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    order_date = db.Column(db.DateTime, default=datetime.utcnow)
+    order_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     total_amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)
 
+    # A user's orders, newest first
+    __table_args__ = (db.Index('ix_orders_user_date', 'user_id', 'order_date'),)
+
     items = db.relationship('OrderItem', backref='order', lazy=True)
 
     def to_dict(self):
@@ -128,7 +252,7 @@ class Order(db.Model):
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False, default=1)
     price = db.Column(db.Numeric(10,2), nullable=False)
@@ -148,20 +272,237 @@ class SearchKeyword(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     keyword = db.Column(db.String(100), nullable=False)
-    searched_at = db.Column(db.DateTime, default=datetime.utcnow)
+    searched_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class UsedRefreshToken(db.Model):
+    """Refresh tokens are single use; each one is recorded here when redeemed."""
+    __tablename__ = 'used_refresh_tokens'
+    jti = db.Column(db.String(36), primary_key=True)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+# ----------------------
+# Response cache
+# ----------------------
+# Catalog reads are served from cache; any commit that touches a cached
+# model bumps that model's namespace, so the next read goes to the DB.
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 30))
+RESPONSE_CACHE_STALE_TTL = int(os.getenv('RESPONSE_CACHE_STALE_TTL', 300))
+
+def _with_app_context(fn):
+    with app.app_context():
+        return fn()
+
+def _may_store(key):
+    # A replica read shortly after a write to the namespace may predate
+    # that write; caching it under the new version would pin the stale
+    # result, so it is served but not stored
+    if not (has_app_context() and g.get('use_replica')):
+        return True
+    return time.time() - response_cache.invalidated_at(key) >= REPLICA_STICKY_SECONDS
+
+response_cache = ResponseCache(
+    backend_from_env(max_age=RESPONSE_CACHE_TTL + RESPONSE_CACHE_STALE_TTL),
+    ttl=RESPONSE_CACHE_TTL,
+    stale_ttl=RESPONSE_CACHE_STALE_TTL,
+    run_refresh=_with_app_context,
+    should_store=_may_store
+)
+
+CACHED_MODELS = {Product: 'products', Category: 'categories'}
+
+def mark_cache_dirty(session, namespace):
+    """For writes that bypass the ORM unit of work (bulk UPDATE/DELETE)."""
+    session.info.setdefault('dirty_cache_namespaces', set()).add(namespace)
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_dirty_namespaces(session, flush_context, instances):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        namespace = CACHED_MODELS.get(type(obj))
+        if namespace:
+            mark_cache_dirty(session, namespace)
+        elif isinstance(obj, User) and obj.id is not None:
+            session.info.setdefault('dirty_user_ids', set()).add(obj.id)
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_dirty_namespaces(session):
+    for namespace in session.info.pop('dirty_cache_namespaces', ()):
+        response_cache.invalidate(namespace)
+    for user_id in session.info.pop('dirty_user_ids', ()):
+        user_cache.delete(user_id)
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_dirty_namespaces(session):
+    session.info.pop('dirty_cache_namespaces', None)
+    session.info.pop('dirty_user_ids', None)
+
+def cached_json(key, loader):
+    """Serves `loader()` as JSON, caching the serialized body under `key`."""
+    body = response_cache.get_or_load(key, lambda: response_body(app, loader()))
+    return app.response_class(body, mimetype=app.json.mimetype)
+
+def conditional_json(key, loader, watermark, last_modified=None):
+    """
+    Like cached_json, but with a strong ETag derived from `watermark` (any
+    value that changes whenever the result does) and an optional
+    Last-Modified. Matching If-None-Match / If-Modified-Since requests get
+    a 304 without the result being loaded or serialized.
+    """
+    etag = hashlib.sha1(f'{request.full_path}|{watermark}'.encode()).hexdigest()
+    if last_modified is not None:
+        # HTTP dates have second resolution
+        last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = (last_modified is not None and request.if_modified_since is not None
+                        and last_modified <= request.if_modified_since)
+
+    if not_modified:
+        resp = app.response_class(status=304)
+    else:
+        # Keying on the ETag too keeps the body in step with the validators
+        resp = cached_json(f'{key}:{etag}', loader)
+    resp.set_etag(etag)
+    if last_modified is not None:
+        resp.last_modified = last_modified
+    return resp
+
+# ----------------------
+# User identity cache
+# ----------------------
+# JWT routes resolve the token's user through this loader. The serialized
+# user is kept per process for USER_CACHE_TTL seconds and dropped when a
+# commit touches that user, so most authenticated requests skip the
+# users-table lookup entirely.
+user_cache = LRUCache(maxsize=int(os.getenv('USER_CACHE_SIZE', 10000)),
+                      max_age=int(os.getenv('USER_CACHE_TTL', 60)))
+
+@jwt.user_lookup_loader
+def load_user(jwt_header, jwt_data):
+    # Subjects are strings in the token; keys are int ids, matching the
+    # invalidation hook, which sees User.id
+    user_id = int(jwt_data[app.config['JWT_IDENTITY_CLAIM']])
+    entry = user_cache.get(user_id)
+    if entry is not None:
+        return entry[0]
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    user_cache.set(user_id, user.to_dict())
+    return user_cache.get(user_id)[0]
+
+def current_user_id():
+    """The JWT subject as an int user id (tokens carry it as a string)."""
+    return int(get_jwt_identity())
+
+@jwt.user_lookup_error_loader
+def user_lookup_error(jwt_header, jwt_data):
+    return jsonify({'message': 'User not found'}), 401
+
+# ----------------------
+# Rate limiting
+# ----------------------
+# Token buckets for the endpoints that cost real work per request (bcrypt,
+# ILIKE scans, model inference). Rules can be tuned or switched off per
+# name via RATE_LIMITS without a code change.
+rate_limiter = limiter_from_env()
+
+def _rate_limit_keys(per):
+    keys = []
+    for kind in per:
+        if kind == 'ip':
+            keys.append(f'ip:{request.remote_addr}')
+        elif kind == 'user':
+            keys.append(f'user:{get_jwt_identity()}')
+        elif kind == 'ip_email':
+            # Per account and address: guessing one account from one IP is
+            # capped, but other addresses can't use it to lock the owner out
+            email = (request.get_json(silent=True) or {}).get('email')
+            if email:
+                keys.append(f'ip_email:{request.remote_addr}:{normalize_email(email)}')
+    return keys
+
+def check_rate_limit(name, rule, per=('ip',)):
+    rate_limiter.hit(name, rule, _rate_limit_keys(per))
+
+def rate_limited(name, rule, per=('ip',)):
+    """Route decorator; put it below @jwt_required when `per` includes 'user'."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            check_rate_limit(name, rule, per)
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@app.errorhandler(RateLimited)
+def rate_limit_exceeded(e):
+    resp = jsonify({'message': 'Too many requests, please slow down'})
+    resp.headers['Retry-After'] = str(ceil(e.retry_after))
+    return resp, 429
+
+# ----------------------
+# Read replica routing
+# ----------------------
+# After a client writes, its reads stay on the primary for
+# REPLICA_STICKY_SECONDS so it sees its own changes despite replication
+# lag. Browsers carry that as a cookie; for API clients the authenticated
+# user's last write time is also kept per process. The same window bounds
+# how long replica reads stay out of the response cache after a write.
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 10))
+PRIMARY_COOKIE = 'primary_until'
+recent_writers = LRUCache(maxsize=10000, max_age=REPLICA_STICKY_SECONDS)
+
+def _jwt_identity_or_none():
+    # Public routes don't require a token, so verify one here if it was sent
+    try:
+        verify_jwt_in_request(optional=True)
+    except (JWTExtendedException, PyJWTError):
+        # A bad or expired token reads like an anonymous request
+        return None
+    identity = get_jwt_identity()
+    return None if identity is None else str(identity)
+
+def _recently_wrote():
+    primary_until = request.cookies.get(PRIMARY_COOKIE, '')
+    if primary_until.isdigit() and int(primary_until) > time.time():
+        return True
+    user_id = _jwt_identity_or_none()
+    return user_id is not None and recent_writers.get(user_id) is not None
+
+def read_only(fn):
+    """
+    Routes the view's SELECTs to the replica unless the client wrote
+    recently; put it below @jwt_required on authenticated routes.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        g.use_replica = DATABASE_REPLICA_URL is not None and not _recently_wrote()
+        return fn(*args, **kwargs)
+    return wrapper
+
+@app.after_request
+def _stick_to_primary_after_write(response):
+    if DATABASE_REPLICA_URL and g.get('wrote_primary'):
+        response.set_cookie(PRIMARY_COOKIE, str(int(time.time()) + REPLICA_STICKY_SECONDS),
+                            max_age=REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax')
+        user_id = _jwt_identity_or_none()
+        if user_id is not None:
+            recent_writers.set(user_id, True)
+    return response
 
 # ----------------------
 # Authentication routes
-#removebelow
-@app.route('/api/debug/users', methods=['GET'])
-def debug_list_users():
-    users = User.query.all()
-    return jsonify([u.to_dict() for u in users])
 # ----------------------
+def normalize_email(email):
+    return str(email).strip().lower()
+
 @app.route("/")
 def home():
     return "Hello, World!"
 @app.route('/api/auth/register', methods=['POST'])
+@rate_limited('register', '5/minute burst 10')
 def register():
     data = request.get_json() or {}
     username = data.get('username')
@@ -170,19 +511,26 @@ def register():
     if not (username and email and password):
         return jsonify({'message': 'username, email and password required'}), 400
 
-    if User.query.filter_by(email=email).first():
-        return jsonify({'message': 'Email already registered'}), 400
-
-    pw_hash = bcrypt.generate_password_hash(password).decode('utf-8')
-    user = User(username=username, email=email, password_hash=pw_hash)
+    pw_hash = password_hasher.hash(password)
+    user = User(username=username, email=normalize_email(email), password_hash=pw_hash)
     db.session.add(user)
-    db.session.commit()
+    try:
+        # The unique index is the duplicate check, so there's no race
+        # between looking the email up and inserting it
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'message': 'Email already registered'}), 400
 
-    access_token = create_access_token(identity=user.id)
-    return jsonify({'message': 'User registered', 'access_token': access_token, 'user': user.to_dict()}), 201
+    access_token = create_access_token(identity=str(user.id))
+    refresh_token = create_refresh_token(identity=str(user.id))
+    return jsonify({'message': 'User registered', 'access_token': access_token, 'refresh_token': refresh_token,
+                    'user': user.to_dict()}), 201
 
 
 @app.route('/api/auth/login', methods=['POST'])
+@rate_limited('login', '20/minute')
+@rate_limited('login_account', '5/minute', per=('ip_email',))
 def login():
     data = request.get_json() or {}
     email = data.get('email')
@@ -190,12 +538,49 @@ def login():
     if not (email and password):
         return jsonify({'message': 'email and password required'}), 400
 
-    user = User.query.filter_by(email=email).first()
-    if not user or not bcrypt.check_password_hash(user.password_hash, password):
+    user = User.query.filter(func.lower(User.email) == normalize_email(email)).first()
+    if not user or not password_hasher.check(user.password_hash, password):
         return jsonify({'message': 'Invalid credentials'}), 401
+    if password_hasher.needs_rehash(user.password_hash):
+        # Upgrade hashes made with an older cost factor while we have the password
+        user.password_hash = password_hasher.hash(password)
+        db.session.commit()
 
-    access_token = create_access_token(identity=user.id)
-    return jsonify({'message': 'Login successful', 'access_token': access_token, 'user': user.to_dict()})
+    access_token = create_access_token(identity=str(user.id))
+    refresh_token = create_refresh_token(identity=str(user.id))
+    return jsonify({'message': 'Login successful', 'access_token': access_token, 'refresh_token': refresh_token,
+                    'user': user.to_dict()})
+
+@app.route('/api/auth/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh():
+    user_id = get_jwt_identity()
+    claims = get_jwt()
+    # Rotation: the primary key makes redeeming a token an atomic claim, so
+    # a replayed (or concurrently reused) refresh token is rejected
+    db.session.add(UsedRefreshToken(jti=claims['jti'], expires_at=datetime.utcfromtimestamp(claims['exp'])))
+    if random.random() < 0.01:
+        # Expired tokens fail signature checks anyway; their rows can go
+        db.session.execute(delete(UsedRefreshToken).where(UsedRefreshToken.expires_at < datetime.utcnow()))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'message': 'Refresh token already used'}), 401
+
+    access_token = create_access_token(identity=user_id)
+    refresh_token = create_refresh_token(identity=user_id)
+    return jsonify({'access_token': access_token, 'refresh_token': refresh_token})
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(e):
+    resp = jsonify({'message': 'Server busy, please retry shortly'})
+    resp.headers['Retry-After'] = '1'
+    return resp, 503
+
+@app.route('/api/metrics/password_hashing', methods=['GET'])
+def password_hashing_metrics():
+    return jsonify(password_hasher.stats())
 
 # ----------------------
 # User profile
@@ -203,14 +588,13 @@ def login():
 @app.route('/api/users/me', methods=['GET'])
 @jwt_required()
 def get_profile():
-    user_id = get_jwt_identity()
-    user = User.query.get_or_404(user_id)
-    return jsonify(user.to_dict())
+    # Resolved by load_user, usually from the identity cache
+    return jsonify(get_current_user())
 
 @app.route('/api/users/me', methods=['PUT'])
 @jwt_required()
 def update_profile():
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     user = User.query.get_or_404(user_id)
     data = request.get_json() or {}
     username = data.get('username')
@@ -220,24 +604,28 @@ def update_profile():
     if username:
         user.username = username
     if email:
-        # optional: check email uniqueness
-        existing = User.query.filter(User.email==email, User.id!=user.id).first()
-        if existing:
-            return jsonify({'message': 'Email already in use'}), 400
-        user.email = email
+        user.email = normalize_email(email)
     if password:
-        user.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        user.password_hash = password_hasher.hash(password)
 
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'message': 'Email already in use'}), 400
     return jsonify({'message': 'Profile updated', 'user': user.to_dict()})
 
 # ----------------------
 # Categories
 # ----------------------
 @app.route('/api/categories', methods=['GET'])
+@read_only
 def list_categories():
-    cats = Category.query.order_by(Category.name).all()
-    return jsonify([c.to_dict() for c in cats])
+    # Categories are only ever added, so the max id and count identify a version
+    watermark = db.session.query(func.max(Category.id), func.count(Category.id)).one()
+    key = response_cache.key('categories', 'list')
+    return conditional_json(key, lambda: [c.to_dict() for c in Category.query.order_by(Category.name).all()],
+                            watermark=tuple(watermark))
 
 # Development helper: seed categories (not protected)
 @app.route('/api/seed_categories', methods=['POST'])
@@ -255,14 +643,34 @@ def seed_categories():
 # ----------------------
 # Products (CRUD) with filtering & search & pagination
 # ----------------------
-@app.route('/api/products', methods=['GET'])
-def get_products():
-    # query params: category, keyword, page, per_page
-    category = request.args.get('category')
-    keyword = request.args.get('keyword')
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 20))
+def requested_product_fields():
+    """
+    Parses the `fields` query param into a list of product fields, or None
+    for all of them. Raises ValueError on unknown field names.
+    """
+    if not request.args.get('fields'):
+        return None
+    fields = sorted({f.strip() for f in request.args['fields'].split(',') if f.strip()})
+    unknown = [f for f in fields if f not in Product._serializers]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    return fields
+
+def product_query(fields=None):
+    """Product query that only SELECTs the requested columns."""
+    if fields is None:
+        return Product.query
+    return Product.query.options(load_only(*[getattr(Product, f) for f in fields]))
+
+def products_by_ids(ids, fields=None):
+    """Loads products in one IN (...) query, keeping the order of `ids`."""
+    ids = [int(i) for i in ids]  # the recommenders hand back numpy ints
+    found = {p.id: p for p in product_query(fields).filter(Product.id.in_(ids)).all()} if ids else {}
+    return [found[i] for i in ids if i in found]
+
+MAX_BATCH_IDS = 100
 
+def _filtered_products(category, keyword):
     q = Product.query
     if category:
         # allow either category id or name
@@ -272,111 +680,542 @@ def get_products():
             q = q.join(Category).filter(Category.name.ilike(f"%{category}%"))
     if keyword:
         q = q.filter(Product.title.ilike(f"%{keyword}%"))
+    return q
+
+def _product_listing(category, keyword, page, per_page, fields=None):
+    # Same clamping as paginate(error_out=False)
+    page = page if page >= 1 else 1
+    per_page = per_page if per_page >= 1 else 20
+
+    # Plain row tuples instead of ORM objects; serialization handles the
+    # Numeric and DateTime values the same way Product.to_dict does
+    q = _filtered_products(category, keyword)
+    total = q.order_by(None).count()
+    columns = [getattr(Product, f) for f in (fields or Product._serializers)]
+    rows = q.with_entities(*columns).order_by(Product.created_at.desc()) \
+        .limit(per_page).offset((page - 1) * per_page).all()
+    return {
+        'items': [row._asdict() for row in rows],
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': ceil(total / per_page) if total else 0
+    }
+
+@app.route('/api/products', methods=['GET'])
+@read_only
+def get_products():
+    # query params: ids (batch lookup) or category, keyword, page, per_page;
+    # fields limits the product keys returned
+    try:
+        fields = requested_product_fields()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    if request.args.get('ids'):
+        try:
+            ids = [int(i) for i in request.args['ids'].split(',') if i.strip()]
+        except ValueError:
+            return jsonify({'message': 'ids must be a comma-separated list of integers'}), 400
+        if len(ids) > MAX_BATCH_IDS:
+            return jsonify({'message': f'at most {MAX_BATCH_IDS} ids per request'}), 400
+        key = response_cache.key('products', 'batch', ids=','.join(map(str, ids)), fields=fields and ','.join(fields))
+        return cached_json(key, lambda: {'items': [p.to_dict(fields) for p in products_by_ids(ids, fields)]})
+
+    category = request.args.get('category')
+    keyword = request.args.get('keyword')
+    page = int(request.args.get('page', 1))
+    per_page = int(request.args.get('per_page', 20))
+
+    if keyword:
+        # ILIKE '%keyword%' can't use an index, so searches are limited
+        check_rate_limit('search', '60/minute burst 20')
         # store keyword for analytics (optional)
         kw = SearchKeyword(keyword=keyword)
         db.session.add(kw)
         db.session.commit()
 
-    pag = q.order_by(Product.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
-    items = [p.to_dict() for p in pag.items]
-    return jsonify({
-        'items': items,
-        'total': pag.total,
-        'page': pag.page,
-        'per_page': pag.per_page,
-        'pages': pag.pages
-    })
+    # Any insert, update or delete in the filtered set moves one of these.
+    # The aggregate scans the filtered set, so it's cached like the pages
+    # themselves: under the namespace version, which every product write bumps.
+    # There's no Last-Modified: a delete leaves max(updated_at) unchanged, so
+    # only the ETag can tell If-Modified-Since clients the listing changed.
+    watermark_key = response_cache.key('products', 'watermark', category=category, keyword=keyword)
+    watermark = response_cache.get_or_load(watermark_key, lambda: tuple(
+        _filtered_products(category, keyword).with_entities(
+            func.max(Product.updated_at), func.max(Product.id), func.count(Product.id)
+        ).one()
+    ))
+    key = response_cache.key('products', 'list', category=category, keyword=keyword, page=page, per_page=per_page,
+                             fields=fields and ','.join(fields))
+    return conditional_json(key, lambda: _product_listing(category, keyword, page, per_page, fields),
+                            watermark=watermark)
 
 @app.route('/api/products', methods=['POST'])
 @jwt_required()
 def create_product():
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     data = request.get_json() or {}
     required = ['title', 'category_id', 'price']
     for f in required:
         if f not in data:
             return jsonify({'message': f'{f} is required'}), 400
 
-    product = Product(
+    # RETURNING gives the values as stored (ints, rounded price) rather than
+    # echoing whatever types the request sent
+    row = db.session.execute(insert(Product).values(
         user_id=user_id,
         title=data['title'],
         description=data.get('description', ''),
         category_id=data['category_id'],
         price=data['price'],
         image_url=data.get('image_url', 'https://via.placeholder.com/300')
-    )
-    db.session.add(product)
+    ).returning(*[getattr(Product, f) for f in Product._serializers])).one()
+    mark_cache_dirty(db.session, 'products')
     db.session.commit()
-    return jsonify({'message': 'Product created', 'product': product.to_dict()}), 201
+    return jsonify({'message': 'Product created', 'product': product_row_dict(row)}), 201
 
 @app.route('/api/products/<int:product_id>', methods=['GET'])
+@read_only
 def get_product(product_id):
-    p = Product.query.get_or_404(product_id)
-    return jsonify(p.to_dict())
+    try:
+        fields = requested_product_fields()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    updated_at = db.session.query(Product.updated_at).filter(Product.id == product_id).scalar()
+    if updated_at is None:
+        abort(404)
+    key = response_cache.key('products', 'detail', product_id, fields=fields and ','.join(fields))
+    return conditional_json(key, lambda: product_query(fields).get_or_404(product_id).to_dict(fields),
+                            watermark=updated_at, last_modified=updated_at)
+
+PRODUCT_EDITABLE_FIELDS = ['title', 'description', 'category_id', 'price', 'image_url']
+
+def product_row_dict(row, fields=None):
+    """Product.to_dict for a row selected with the product columns."""
+    return {f: serialize(row) for f, serialize in Product._serializers.items()
+            if fields is None or f in fields}
+
+def _missing_or_forbidden(product_id):
+    """A conditional write matched nothing: tell a missing product from someone else's."""
+    if db.session.query(Product.id).filter(Product.id == product_id).first() is None:
+        abort(404)
+    return jsonify({'message': 'Forbidden: you do not own this product'}), 403
 
 @app.route('/api/products/<int:product_id>', methods=['PUT'])
 @jwt_required()
 def update_product(product_id):
-    user_id = get_jwt_identity()
-    p = Product.query.get_or_404(product_id)
-    if p.user_id != user_id:
-        return jsonify({'message': 'Forbidden: you do not own this product'}), 403
+    user_id = current_user_id()
     data = request.get_json() or {}
-    p.title = data.get('title', p.title)
-    p.description = data.get('description', p.description)
-    p.category_id = data.get('category_id', p.category_id)
-    p.price = data.get('price', p.price)
-    p.image_url = data.get('image_url', p.image_url)
-    db.session.commit()
-    return jsonify({'message': 'Product updated', 'product': p.to_dict()})
+    values = {f: data[f] for f in PRODUCT_EDITABLE_FIELDS if f in data}
+    columns = [getattr(Product, f) for f in Product._serializers]
+    owned = [Product.id == product_id, Product.user_id == user_id]
+
+    if not values:
+        row = db.session.query(*columns).filter(*owned).first()
+    else:
+        # One conditional UPDATE ... RETURNING; the ownership check is in the WHERE
+        stmt = update(Product).where(*owned).values(**values).execution_options(synchronize_session=False)
+        if db.session.get_bind().dialect.update_returning:
+            row = db.session.execute(stmt.returning(*columns)).first()
+        else:
+            row = db.session.query(*columns).filter(*owned).first() \
+                if db.session.execute(stmt).rowcount else None
+        mark_cache_dirty(db.session, 'products')
+        db.session.commit()
+
+    if row is None:
+        return _missing_or_forbidden(product_id)
+    return jsonify({'message': 'Product updated', 'product': product_row_dict(row)})
 
 @app.route('/api/products/<int:product_id>', methods=['DELETE'])
 @jwt_required()
 def delete_product(product_id):
-    user_id = get_jwt_identity()
-    p = Product.query.get_or_404(product_id)
-    if p.user_id != user_id:
-        return jsonify({'message': 'Forbidden: you do not own this product'}), 403
-    db.session.delete(p)
-    db.session.commit()
+    user_id = current_user_id()
+    owned = select(Product.id).where(Product.id == product_id, Product.user_id == user_id)
+    stmt = delete(Product).where(Product.id == product_id, Product.user_id == user_id) \
+        .execution_options(synchronize_session=False)
+    try:
+        # Drop the product from everyone's carts before deleting it
+        db.session.execute(delete(CartItem).where(CartItem.product_id.in_(owned))
+                           .execution_options(synchronize_session=False))
+        deleted = db.session.execute(stmt).rowcount
+        mark_cache_dirty(db.session, 'products')
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'message': 'Product is part of existing orders and cannot be deleted'}), 409
+    if not deleted:
+        return _missing_or_forbidden(product_id)
     return jsonify({'message': 'Product deleted'})
 
+# ----------------------
+# Bulk product changes
+# ----------------------
+# Each request is a single set-based statement scoped to the caller's own
+# products; IDs the caller doesn't own are simply not affected.
+MAX_BULK_IDS = 1000
+
+def _bulk_ids(data):
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not ids:
+        raise ValueError('ids must be a non-empty list')
+    if len(ids) > MAX_BULK_IDS:
+        raise ValueError(f'at most {MAX_BULK_IDS} ids per request')
+    try:
+        return sorted({int(i) for i in ids})
+    except (TypeError, ValueError):
+        raise ValueError('ids must be integers')
+
+def _execute_returning_ids(stmt):
+    """Runs an UPDATE/DELETE on products and returns the affected IDs."""
+    dialect = db.session.get_bind().dialect
+    supported = dialect.update_returning if stmt.is_update else dialect.delete_returning
+    if supported:
+        return sorted(db.session.execute(stmt.returning(Product.id)).scalars())
+    # No RETURNING: read the matching IDs first, inside the same transaction
+    ids = sorted(db.session.execute(select(Product.id).where(stmt.whereclause)).scalars())
+    db.session.execute(stmt)
+    return ids
+
+@app.route('/api/products/bulk_update', methods=['POST'])
+@jwt_required()
+def bulk_update_products():
+    # body: ids plus one of price / price_delta / price_percent, and/or category_id
+    user_id = current_user_id()
+    data = request.get_json() or {}
+    try:
+        ids = _bulk_ids(data)
+        price_modes = [m for m in ('price', 'price_delta', 'price_percent') if data.get(m) is not None]
+        if len(price_modes) > 1:
+            raise ValueError('use only one of price, price_delta and price_percent')
+        values = {}
+        conditions = [Product.user_id == user_id, Product.id.in_(ids)]
+        if price_modes:
+            amount = Decimal(str(data[price_modes[0]]))
+            if not amount.is_finite():
+                raise ValueError(f'{price_modes[0]} must be a number')
+            if price_modes[0] == 'price':
+                if amount < 0 or amount >= 10 ** 8:
+                    raise ValueError('price must be between 0 and 99999999.99')
+                values['price'] = amount
+            elif price_modes[0] == 'price_delta':
+                values['price'] = Product.price + amount
+                # Skip products the change would push out of range
+                conditions.append(values['price'].between(0, Decimal('99999999.99')))
+            else:
+                if amount <= -100:
+                    raise ValueError('price_percent must be greater than -100')
+                values['price'] = func.round(Product.price * (1 + amount / 100), 2)
+                conditions.append(values['price'] < 10 ** 8)
+        if data.get('category_id') is not None:
+            try:
+                values['category_id'] = int(data['category_id'])
+            except (TypeError, ValueError):
+                raise ValueError('category_id must be an integer')
+            if db.session.get(Category, values['category_id']) is None:
+                raise ValueError(f"category {values['category_id']} does not exist")
+        if not values:
+            raise ValueError('nothing to update')
+    except InvalidOperation:
+        return jsonify({'message': 'price values must be numbers'}), 400
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    stmt = update(Product).where(*conditions).values(**values) \
+        .execution_options(synchronize_session=False)
+    updated = _execute_returning_ids(stmt)
+    mark_cache_dirty(db.session, 'products')
+    db.session.commit()
+    return jsonify({'message': 'Products updated', 'updated_ids': updated})
+
+@app.route('/api/products/bulk_delete', methods=['POST'])
+@jwt_required()
+def bulk_delete_products():
+    user_id = current_user_id()
+    try:
+        ids = _bulk_ids(request.get_json() or {})
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    owned = select(Product.id).where(Product.user_id == user_id, Product.id.in_(ids))
+    try:
+        # Drop the products from everyone's carts before deleting them
+        db.session.execute(delete(CartItem).where(CartItem.product_id.in_(owned))
+                           .execution_options(synchronize_session=False))
+        stmt = delete(Product).where(Product.user_id == user_id, Product.id.in_(ids)) \
+            .execution_options(synchronize_session=False)
+        deleted = _execute_returning_ids(stmt)
+        mark_cache_dirty(db.session, 'products')
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'message': 'Some products are part of existing orders and cannot be deleted'}), 409
+    return jsonify({'message': 'Products deleted', 'deleted_ids': deleted})
+
+# ----------------------
+# Bulk product import
+# ----------------------
+# Accepts a JSON array body, an NDJSON or CSV body, or the same formats as
+# an uploaded `file`. Rows are validated one at a time as they are read and
+# inserted IMPORT_CHUNK_SIZE at a time (COPY on Postgres with psycopg2,
+# executemany elsewhere), each chunk in its own transaction.
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 1000))
+MAX_IMPORT_ERRORS = 1000
+IMPORT_COLUMNS = ['user_id', 'title', 'description', 'category_id', 'price', 'image_url', 'created_at', 'updated_at']
+
+def _import_rows():
+    """Yields (row_number, row_or_parse_error) from the request body or upload."""
+    upload = request.files.get('file')
+    if upload:
+        name = (upload.filename or '').lower()
+        fmt = 'csv' if name.endswith('.csv') else 'ndjson' if name.endswith(('.ndjson', '.jsonl')) else 'json'
+        stream = upload.stream
+    else:
+        fmt = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson'}.get(request.mimetype, 'json')
+        stream = request.stream
+
+    if fmt == 'json':
+        rows = json.load(stream)
+        if not isinstance(rows, list):
+            raise ValueError('expected a JSON array of products')
+        yield from enumerate(rows, start=1)
+    elif fmt == 'csv':
+        yield from enumerate(csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline='')), start=1)
+    else:
+        for n, line in enumerate(io.TextIOWrapper(stream, encoding='utf-8'), start=1):
+            if not line.strip():
+                continue
+            try:
+                yield n, json.loads(line)
+            except ValueError as e:
+                yield n, ValueError(f'invalid JSON: {e}')
+
+def _validate_import_row(data, user_id, category_ids, now):
+    """Returns the insert params for one row, or raises ValueError."""
+    if isinstance(data, Exception):
+        raise data
+    if not isinstance(data, dict):
+        raise ValueError('expected an object')
+    for f in ['title', 'category_id', 'price']:
+        if data.get(f) in (None, ''):
+            raise ValueError(f'{f} is required')
+    for f in ['title', 'description', 'image_url']:
+        if data.get(f) is not None and not isinstance(data[f], str):
+            raise ValueError(f'{f} must be a string')
+
+    title = data['title']
+    if len(title) > 200:
+        raise ValueError('title is longer than 200 characters')
+    try:
+        category_id = int(data['category_id'])
+        price = Decimal(str(data['price']))
+    except (TypeError, ValueError, InvalidOperation):
+        raise ValueError('category_id must be an integer and price a number')
+    if category_id not in category_ids:
+        raise ValueError(f'category {category_id} does not exist')
+    if not price.is_finite() or price < 0 or price >= 10 ** 8:
+        raise ValueError('price must be between 0 and 99999999.99')
+    image_url = data.get('image_url') or 'https://via.placeholder.com/300'
+    if len(image_url) > 255:
+        raise ValueError('image_url is longer than 255 characters')
+
+    return {
+        'user_id': user_id,
+        'title': title,
+        'description': data.get('description') or '',
+        'category_id': category_id,
+        'price': price.quantize(Decimal('0.01')),
+        'image_url': image_url,
+        'created_at': now,
+        'updated_at': now
+    }
+
+def _copy_value(value):
+    # COPY text format: \N is NULL; backslash, tab and newlines are escaped
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def _insert_product_chunk(chunk):
+    conn = db.session.connection()
+    if conn.dialect.name == 'postgresql' and conn.dialect.driver == 'psycopg2':
+        buf = io.StringIO()
+        for row in chunk:
+            buf.write('\t'.join(_copy_value(row[c]) for c in IMPORT_COLUMNS) + '\n')
+        buf.seek(0)
+        with conn.connection.dbapi_connection.cursor() as cur:
+            cur.copy_expert(f"COPY products ({', '.join(IMPORT_COLUMNS)}) FROM STDIN", buf)
+    else:
+        db.session.execute(insert(Product), chunk)
+    mark_cache_dirty(db.session, 'products')
+    db.session.commit()
+
+@app.route('/api/products/import', methods=['POST'])
+@jwt_required()
+def import_products():
+    user_id = current_user_id()
+    category_ids = {cid for (cid,) in db.session.query(Category.id)}
+    now = datetime.utcnow()
+
+    inserted, failed, errors, chunk = 0, 0, [], []
+    try:
+        for n, data in _import_rows():
+            try:
+                chunk.append(_validate_import_row(data, user_id, category_ids, now))
+            except ValueError as e:
+                failed += 1
+                if len(errors) < MAX_IMPORT_ERRORS:
+                    errors.append({'row': n, 'message': str(e)})
+                continue
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                _insert_product_chunk(chunk)
+                inserted += len(chunk)
+                chunk = []
+        if chunk:
+            _insert_product_chunk(chunk)
+            inserted += len(chunk)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        # The body itself is unreadable; chunks already committed stay
+        db.session.rollback()
+        return jsonify({'message': f'Could not read import: {e}', 'inserted': inserted}), 400
+
+    return jsonify({
+        'message': 'Import finished',
+        'inserted': inserted,
+        'failed': failed,
+        'errors': errors,
+        'errors_truncated': failed > len(errors)
+    }), 201 if inserted else 200
+
 # ----------------------
 # Cart
 # ----------------------
 @app.route('/api/cart', methods=['GET'])
 @jwt_required()
 def get_cart():
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     items = CartItem.query.filter_by(user_id=user_id).all()
     return jsonify([it.to_dict() for it in items])
 
+def upsert(model):
+    """INSERT ... ON CONFLICT for the current dialect (SQLite or Postgres)."""
+    dialect = db.session.get_bind().dialect.name
+    return (postgresql if dialect == 'postgresql' else sqlite).insert(model)
+
 @app.route('/api/cart', methods=['POST'])
 @jwt_required()
 def add_to_cart():
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     data = request.get_json() or {}
     product_id = data.get('product_id')
     quantity = int(data.get('quantity', 1))
     if not product_id:
         return jsonify({'message': 'product_id required'}), 400
-    product = Product.query.get(product_id)
-    if not product:
+
+    # A single upsert. Inserting from a SELECT on products doubles as the
+    # existence check: an unknown product yields no row. Concurrent adds
+    # of the same product meet on the unique constraint and add up.
+    source = select(literal(user_id, db.Integer), Product.id, literal(quantity, db.Integer),
+                    literal(datetime.utcnow(), db.DateTime)).where(Product.id == product_id)
+    stmt = upsert(CartItem).from_select(['user_id', 'product_id', 'quantity', 'added_at'], source)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'product_id'],
+        set_={'quantity': CartItem.quantity + stmt.excluded.quantity}
+    ).returning(CartItem.id, CartItem.quantity, CartItem.added_at)
+    row = db.session.execute(stmt).first()
+    if row is None:
+        db.session.rollback()
         return jsonify({'message': 'Product not found'}), 404
+    # Read inside the same transaction, so the commit doesn't leave a new
+    # one open just for this lookup
+    product = db.session.get(Product, product_id)
+    db.session.commit()
 
-    existing = CartItem.query.filter_by(user_id=user_id, product_id=product_id).first()
-    if existing:
-        existing.quantity = existing.quantity + quantity
-    else:
-        existing = CartItem(user_id=user_id, product_id=product_id, quantity=quantity)
-        db.session.add(existing)
+    return jsonify({'message': 'Added to cart', 'cart_item': {
+        'id': row.id,
+        'user_id': user_id,
+        'product': product.to_dict() if product else None,
+        'quantity': row.quantity,
+        'added_at': row.added_at.isoformat()
+    }})
+
+MAX_CART_OPERATIONS = 200
+
+def _fold_cart_operations(operations):
+    """
+    Reduces a list of add/set/remove operations to one net change per
+    product: ('add', n), ('set', n) or ('remove', None), in request order.
+    """
+    net = {}
+    for i, op in enumerate(operations, start=1):
+        if not isinstance(op, dict) or op.get('op') not in ('add', 'set', 'remove'):
+            raise ValueError(f'operation {i}: op must be add, set or remove')
+        try:
+            product_id = int(op['product_id'])
+            quantity = int(op.get('quantity', 1))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f'operation {i}: product_id and quantity must be integers')
+
+        kind, current = net.get(product_id, ('add', 0))
+        if op['op'] == 'remove' or (op['op'] == 'set' and quantity <= 0):
+            net[product_id] = ('remove', None)
+        elif op['op'] == 'set':
+            net[product_id] = ('set', quantity)
+        elif quantity < 1:
+            raise ValueError(f'operation {i}: quantity to add must be at least 1')
+        elif kind == 'remove':
+            net[product_id] = ('set', quantity)
+        else:
+            net[product_id] = (kind, current + quantity)
+    return net
+
+@app.route('/api/cart/batch', methods=['POST'])
+@jwt_required()
+def batch_cart():
+    # body: {"operations": [{"op": "add" | "set" | "remove", "product_id": 1, "quantity": 2}, ...]}
+    user_id = current_user_id()
+    operations = (request.get_json() or {}).get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'message': 'operations must be a non-empty list'}), 400
+    if len(operations) > MAX_CART_OPERATIONS:
+        return jsonify({'message': f'at most {MAX_CART_OPERATIONS} operations per request'}), 400
+    try:
+        net = _fold_cart_operations(operations)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    upserts = {pid: change for pid, change in net.items() if change[0] != 'remove'}
+    existing = set(db.session.execute(select(Product.id).where(Product.id.in_(upserts))).scalars()) if upserts else set()
+    missing = sorted(set(upserts) - existing)
+    if missing:
+        return jsonify({'message': 'Products not found', 'product_ids': missing}), 404
+
+    # At most one statement per kind of change, all in one transaction
+    now = datetime.utcnow()
+    for kind in ('add', 'set'):
+        rows = [{'user_id': user_id, 'product_id': pid, 'quantity': q, 'added_at': now}
+                for pid, (k, q) in upserts.items() if k == kind]
+        if rows:
+            stmt = upsert(CartItem).values(rows)
+            quantity = CartItem.quantity + stmt.excluded.quantity if kind == 'add' else stmt.excluded.quantity
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=['user_id', 'product_id'], set_={'quantity': quantity}))
+    removes = [pid for pid, (k, _) in net.items() if k == 'remove']
+    if removes:
+        db.session.execute(delete(CartItem).where(CartItem.user_id == user_id, CartItem.product_id.in_(removes))
+                           .execution_options(synchronize_session=False))
     db.session.commit()
-    return jsonify({'message': 'Added to cart', 'cart_item': existing.to_dict()})
+
+    items = CartItem.query.options(joinedload(CartItem.product)) \
+        .filter_by(user_id=user_id).order_by(CartItem.id).all()
+    return jsonify({'message': 'Cart updated', 'items': [it.to_dict() for it in items]})
 
 @app.route('/api/cart/<int:item_id>', methods=['DELETE'])
 @jwt_required()
 def remove_from_cart(item_id):
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     item = CartItem.query.get_or_404(item_id)
     if item.user_id != user_id:
         return jsonify({'message': 'Forbidden'}), 403
@@ -390,26 +1229,28 @@ def remove_from_cart(item_id):
 @app.route('/api/orders', methods=['POST'])
 @jwt_required()
 def create_order():
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     cart_items = CartItem.query.filter_by(user_id=user_id).all()
     if not cart_items:
         return jsonify({'message': 'Cart is empty'}), 400
 
     try:
+        products = {p.id: p for p in products_by_ids([ci.product_id for ci in cart_items])}
         order = Order(user_id=user_id, order_date=datetime.utcnow(), total_amount=0)
         db.session.add(order)
-        total = 0
-        db.session.flush()  # get order.id
+        # Decimal throughout: the response is built from these in-memory
+        # values, so they must be exactly what the Numeric columns store
+        total = Decimal('0.00')
 
         for ci in cart_items:
-            product = Product.query.get(ci.product_id)
-            price = float(product.price)
-            oi = OrderItem(order_id=order.id, product_id=product.id, quantity=ci.quantity, price=price)
-            db.session.add(oi)
+            product = products[ci.product_id]
+            price = product.price
+            # Attached through the relationships, so order.to_dict() needs no reload
+            order.items.append(OrderItem(product=product, quantity=ci.quantity, price=price))
             total += price * ci.quantity
             db.session.delete(ci)  # clear cart
 
-        order.total_amount = total
+        order.total_amount = total.quantize(Decimal('0.01'))
         db.session.commit()
         return jsonify({'message': 'Order created', 'order': order.to_dict()}), 201
     except Exception as e:
@@ -418,10 +1259,251 @@ def create_order():
 
 @app.route('/api/orders', methods=['GET'])
 @jwt_required()
+@read_only
 def list_orders():
-    user_id = get_jwt_identity()
-    orders = Order.query.filter_by(user_id=user_id).order_by(Order.order_date.desc()).all()
-    return jsonify([o.to_dict() for o in orders])
+    user_id = current_user_id()
+    orders = db.session.query(Order.id, Order.user_id, Order.order_date, Order.total_amount) \
+        .filter(Order.user_id == user_id).order_by(Order.order_date.desc()).all()
+
+    # All the user's order lines with their products in one query
+    product_columns = [getattr(Product, f).label(f'product_{f}') for f in Product._serializers]
+    lines = db.session.query(OrderItem.order_id, OrderItem.id, OrderItem.quantity, OrderItem.price, *product_columns) \
+        .join(Order, Order.id == OrderItem.order_id) \
+        .outerjoin(Product, Product.id == OrderItem.product_id) \
+        .filter(Order.user_id == user_id).order_by(OrderItem.id).all()
+
+    items_by_order = {}
+    for line in lines:
+        product = {f: getattr(line, f'product_{f}') for f in Product._serializers}
+        items_by_order.setdefault(line.order_id, []).append({
+            'id': line.id,
+            'product': product if line.product_id is not None else None,
+            'quantity': line.quantity,
+            'price': line.price
+        })
+    return json_response(app, [
+        dict(o._asdict(), items=items_by_order.get(o.id, [])) for o in orders
+    ])
+
+# ----------------------
+# Streaming exports
+# ----------------------
+# Rows come off a server-side cursor (yield_per) and are written out as they
+# arrive, so memory stays flat no matter how many rows are exported.
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'json': 'application/json'}
+
+def export_response(objects, fmt):
+    return app.response_class(
+        stream_with_context(stream_json(objects, fmt, batch_size=EXPORT_BATCH_SIZE)),
+        mimetype=EXPORT_FORMATS[fmt]
+    )
+
+def _export_args():
+    """Parses the shared export params: format and updated_since."""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    since = request.args.get('updated_since')
+    return fmt, datetime.fromisoformat(since) if since else None
+
+@app.route('/api/export/products', methods=['GET'])
+def export_products():
+    # query params: format (ndjson or json), updated_since (ISO 8601), fields
+    try:
+        fmt, since = _export_args()
+        fields = requested_product_fields()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    q = db.session.query(*[getattr(Product, f) for f in (fields or Product._serializers)])
+    if since:
+        q = q.filter(Product.updated_at >= since)
+    rows = q.order_by(Product.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    return export_response((row._asdict() for row in rows), fmt)
+
+@app.route('/api/export/orders', methods=['GET'])
+@jwt_required()
+def export_orders():
+    # query params: format (ndjson or json), updated_since (ISO 8601, matched on order_date)
+    user_id = current_user_id()
+    try:
+        fmt, since = _export_args()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    # One row per order line, ordered so each order's lines are adjacent
+    product_columns = [getattr(Product, f).label(f'product_{f}') for f in Product._serializers]
+    q = db.session.query(Order.id, Order.user_id, Order.order_date, Order.total_amount,
+                         OrderItem.id.label('item_id'), OrderItem.quantity, OrderItem.price, *product_columns) \
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id) \
+        .outerjoin(Product, Product.id == OrderItem.product_id) \
+        .filter(Order.user_id == user_id)
+    if since:
+        q = q.filter(Order.order_date >= since)
+    rows = q.order_by(Order.order_date.desc(), Order.id, OrderItem.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    def orders():
+        current = None
+        for row in rows:
+            if current is None or current['id'] != row.id:
+                if current is not None:
+                    yield current
+                current = {'id': row.id, 'user_id': row.user_id, 'order_date': row.order_date,
+                           'total_amount': row.total_amount, 'items': []}
+            if row.item_id is not None:
+                product = {f: getattr(row, f'product_{f}') for f in Product._serializers}
+                current['items'].append({
+                    'id': row.item_id,
+                    'product': product if row.product_id is not None else None,
+                    'quantity': row.quantity,
+                    'price': row.price
+                })
+        if current is not None:
+            yield current
+
+    return export_response(orders(), fmt)
+
+# ----------------------
+# Admin
+# ----------------------
+# Comma-separated emails of the accounts allowed to use the admin routes
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv('ADMIN_EMAILS', '').split(',') if e.strip()}
+ADMIN_USERS_MAX_LIMIT = 1000
+
+def admin_required(fn):
+    """Goes below @jwt_required; checks the cached identity, so no extra query."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if get_current_user()['email'].lower() not in ADMIN_EMAILS:
+            return jsonify({'message': 'Admin access required'}), 403
+        return fn(*args, **kwargs)
+    return wrapper
+
+@app.route('/api/admin/users', methods=['GET'])
+@jwt_required()
+@admin_required
+@rate_limited('admin_users', '60/minute', per=('user',))
+def admin_list_users():
+    # query params: after_id, limit, email_prefix, created_after,
+    # created_before (ISO 8601); format=ndjson streams every match instead
+    # of returning one page
+    try:
+        after_id = int(request.args.get('after_id', 0))
+        limit = int(request.args.get('limit', 100))
+        created_after = request.args.get('created_after')
+        created_before = request.args.get('created_before')
+        created_after = datetime.fromisoformat(created_after) if created_after else None
+        created_before = datetime.fromisoformat(created_before) if created_before else None
+    except ValueError:
+        return jsonify({'message': 'after_id and limit must be integers, dates ISO 8601'}), 400
+    if not 1 <= limit <= ADMIN_USERS_MAX_LIMIT:
+        return jsonify({'message': f'limit must be between 1 and {ADMIN_USERS_MAX_LIMIT}'}), 400
+    fmt = request.args.get('format')
+    if fmt not in (None, 'ndjson'):
+        return jsonify({'message': 'format must be ndjson'}), 400
+
+    # Keyset pagination: WHERE id > after_id ORDER BY id walks the primary
+    # key index, so deep pages cost the same as the first one
+    q = db.session.query(User.id, User.username, User.email, User.created_at).filter(User.id > after_id)
+    email_prefix = request.args.get('email_prefix')
+    if email_prefix:
+        q = q.filter(User.email.startswith(normalize_email(email_prefix), autoescape=True))
+    if created_after:
+        q = q.filter(User.created_at >= created_after)
+    if created_before:
+        q = q.filter(User.created_at < created_before)
+    q = q.order_by(User.id)
+
+    if fmt == 'ndjson':
+        rows = q.execution_options(yield_per=EXPORT_BATCH_SIZE)
+        return export_response((row._asdict() for row in rows), fmt)
+
+    users = [row._asdict() for row in q.limit(limit).all()]
+    next_after_id = users[-1]['id'] if len(users) == limit else None
+    return json_response(app, {'users': users, 'next_after_id': next_after_id})
+
+# ----------------------
+# Recommendations & visual search
+# ----------------------
+# ai_agents loads the CLIP model and the FAISS indexes on import, so it is
+# imported on first use rather than at app startup.
+RECOMMENDATION_ENGINES = {
+    'user': 'get_recommendations',
+    'item': 'get_item_recommendations',
+    'mf': 'get_mf_recommendations',
+}
+MAX_SIMILAR_TOP_K = 50
+
+def fetch_interactions_since(since):
+    """Purchases and cart adds newer than `since`, for ai_agents' interaction feed."""
+    import ai_agents
+    with app.app_context():
+        purchases = db.session.query(Order.user_id, OrderItem.product_id, Order.order_date) \
+            .join(OrderItem, OrderItem.order_id == Order.id)
+        cart_adds = db.session.query(CartItem.user_id, CartItem.product_id, CartItem.added_at)
+        if since is not None:
+            purchases = purchases.filter(Order.order_date > since)
+            cart_adds = cart_adds.filter(CartItem.added_at > since)
+        return [(u, p, ai_agents.PURCHASE_SCORE, t) for u, p, t in purchases] + \
+               [(u, p, ai_agents.CART_SCORE, t) for u, p, t in cart_adds]
+
+def load_ai_agents():
+    """Imports ai_agents on first use and starts feeding it new interactions."""
+    import ai_agents
+    ai_agents.start_interactions_consumer(fetch_interactions_since)
+    return ai_agents
+
+def _agent_result(result):
+    """ai_agents functions return either a dict or a (dict, status) tuple."""
+    if isinstance(result, tuple):
+        return result
+    return result, 200
+
+@app.route('/api/recommendations', methods=['GET'])
+@jwt_required()
+@rate_limited('recommendations', '30/minute', per=('ip', 'user'))
+def recommendations():
+    user_id = current_user_id()
+    engine = request.args.get('engine', 'user')
+    if engine not in RECOMMENDATION_ENGINES:
+        return jsonify({'message': f"engine must be one of {', '.join(RECOMMENDATION_ENGINES)}"}), 400
+    try:
+        fields = requested_product_fields()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    ai_agents = load_ai_agents()
+    result, status = _agent_result(getattr(ai_agents, RECOMMENDATION_ENGINES[engine])(user_id))
+    if status != 200:
+        return jsonify(result), status
+    products = products_by_ids(result['recommended_product_ids'], fields)
+    return jsonify({'user_id': user_id, 'products': [p.to_dict(fields) for p in products]})
+
+@app.route('/api/products/similar', methods=['POST'])
+@rate_limited('similar_products', '10/minute')
+def similar_products():
+    image = request.files.get('image')
+    if not image:
+        return jsonify({'message': 'image file required'}), 400
+    try:
+        fields = requested_product_fields()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    try:
+        top_k = int(request.args.get('top_k', 5))
+    except ValueError:
+        return jsonify({'message': 'top_k must be an integer'}), 400
+    if not 1 <= top_k <= MAX_SIMILAR_TOP_K:
+        return jsonify({'message': f'top_k must be between 1 and {MAX_SIMILAR_TOP_K}'}), 400
+
+    ai_agents = load_ai_agents()
+    result, status = _agent_result(ai_agents.find_similar_images(image, top_k=top_k))
+    if status != 200:
+        return jsonify(result), status
+    products = products_by_ids(result['similar_product_ids'], fields)
+    return jsonify({'products': [p.to_dict(fields) for p in products]})
 
 # ----------------------
 # Run server
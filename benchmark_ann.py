@@ -0,0 +1,25 @@
+# benchmark_ann.py - RUN THIS SCRIPT SEPARATELY
+# Compares the HNSW user-neighbour backend against exact brute-force cosine
+# on a synthetic user-item matrix. Usage:
+#   python benchmark_ann.py [n_users] [n_items] [recall_target] [svd_dim]
+import sys
+import numpy as np
+from ai_agents import benchmark_user_ann
+
+n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+n_items = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+recall_target = float(sys.argv[3]) if len(sys.argv) > 3 else 0.95
+svd_dim = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+
+# Each user interacts with a handful of items, skewed towards popular ones
+rng = np.random.default_rng(0)
+popularity = 1.0 / np.arange(1, n_items + 1)
+popularity /= popularity.sum()
+matrix = np.zeros((n_users, n_items), dtype=np.float32)
+for u in range(n_users):
+    items = rng.choice(n_items, size=rng.integers(3, 20), p=popularity)
+    matrix[u, items] = rng.integers(1, 6, size=len(items))
+
+result = benchmark_user_ann(matrix, recall_target=recall_target, svd_dim=svd_dim)
+for key, value in result.items():
+    print(f"{key:>20}: {value}")
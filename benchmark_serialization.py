@@ -0,0 +1,56 @@
+# benchmark_serialization.py - RUN THIS SCRIPT SEPARATELY
+# Compares the old list path (ORM objects -> to_dict -> jsonify) with the
+# row-tuple path used by the list endpoints, on an in-memory SQLite DB.
+# Usage: python benchmark_serialization.py [n_products]
+import os
+import sys
+import time
+from decimal import Decimal
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+from flask import jsonify
+from app import app, db, User, Category, Product
+from serialization import json_response, orjson
+
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+repeat = 5
+
+
+def best_of(fn):
+    timings = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        started = time.perf_counter()
+        body = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), body
+
+
+with app.test_request_context():
+    db.create_all()
+    user = User(username='bench', email='bench@example.com', password_hash='x')
+    category = Category(name='bench')
+    db.session.add_all([user, category])
+    db.session.flush()
+    db.session.add_all([
+        Product(user_id=user.id, category_id=category.id, title=f'Product {i}',
+                description='Lorem ipsum dolor sit amet ' * 20, price=Decimal('19.99') + i)
+        for i in range(n)
+    ])
+    db.session.commit()
+
+    def orm_path():
+        return jsonify([p.to_dict() for p in Product.query.all()]).get_data()
+
+    def row_path():
+        rows = db.session.query(*[getattr(Product, f) for f in Product._serializers]).all()
+        return json_response(app, [r._asdict() for r in rows]).get_data()
+
+    orm_time, orm_body = best_of(orm_path)
+    row_time, row_body = best_of(row_path)
+
+print(f"products:         {n}")
+print(f"encoder:          {'orjson' if orjson else 'json (orjson not installed)'}")
+print(f"ORM + jsonify:    {orm_time * 1000:.1f} ms")
+print(f"rows + fast JSON: {row_time * 1000:.1f} ms ({orm_time / row_time:.1f}x)")
+print(f"identical bytes:  {orm_body == row_body}")
@@ -0,0 +1,196 @@
+# cache.py
+# Small caching layer for read-heavy endpoints. Entries are grouped into
+# namespaces (e.g. "products"); invalidating a namespace bumps its version,
+# which is part of every key, so old entries simply stop being reachable
+# and age out on their own.
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache. Entries are (value, stored_at)."""
+
+    def __init__(self, maxsize=1024, max_age=None):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self._data = OrderedDict()
+        self._versions = {}
+        self._bumped_at = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if self.max_age is not None and time.time() - entry[1] > self.max_age:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def version(self, namespace):
+        return self._versions.get(namespace, 0)
+
+    def bump(self, namespace):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            self._bumped_at[namespace] = time.time()
+
+    def bumped_at(self, namespace):
+        return self._bumped_at.get(namespace, 0)
+
+
+class SQLiteCache:
+    """
+    Cache stored in a local SQLite file, shared by every worker process on
+    the host. Namespace versions live in the same file, so an invalidation
+    in one worker is seen by all of them.
+    """
+
+    def __init__(self, path, max_age=None):
+        self.path = path
+        self.max_age = max_age
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, stored_at REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS versions (namespace TEXT PRIMARY KEY, version INTEGER)')
+            try:
+                # Cache files created before bump times were recorded
+                conn.execute('ALTER TABLE versions ADD COLUMN bumped_at REAL')
+            except sqlite3.OperationalError:
+                pass
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute('SELECT value, stored_at FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if self.max_age is not None and time.time() - row[1] > self.max_age:
+            return None
+        return pickle.loads(row[0]), row[1]
+
+    def set(self, key, value):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('INSERT OR REPLACE INTO cache (key, value, stored_at) VALUES (?, ?, ?)',
+                     (key, pickle.dumps(value), now))
+        if self.max_age is not None and random.random() < 0.01:
+            # Occasionally sweep entries nobody can read anymore
+            conn.execute('DELETE FROM cache WHERE stored_at < ?', (now - self.max_age,))
+
+    def delete(self, key):
+        self._conn().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def version(self, namespace):
+        row = self._conn().execute('SELECT version FROM versions WHERE namespace = ?', (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, namespace):
+        self._conn().execute(
+            'INSERT INTO versions (namespace, version, bumped_at) VALUES (?, 1, ?) '
+            'ON CONFLICT(namespace) DO UPDATE SET version = version + 1, bumped_at = excluded.bumped_at',
+            (namespace, time.time())
+        )
+
+    def bumped_at(self, namespace):
+        row = self._conn().execute('SELECT bumped_at FROM versions WHERE namespace = ?', (namespace,)).fetchone()
+        return (row[0] or 0) if row else 0
+
+
+class ResponseCache:
+    """
+    Caches loader results with a TTL and serves stale-while-revalidate:
+    entries younger than `ttl` are served as is, entries up to
+    `ttl + stale_ttl` old are served while a background thread reloads
+    them, and anything older is loaded inline.
+    """
+
+    def __init__(self, backend, ttl=30, stale_ttl=300, run_refresh=None, should_store=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # Wraps background reloads, e.g. to push a Flask app context
+        self.run_refresh = run_refresh or (lambda fn: fn())
+        # Decides per key whether a freshly loaded value may be cached
+        self.should_store = should_store or (lambda key: True)
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-refresh')
+
+    def key(self, namespace, *parts, **params):
+        """Builds a key from the namespace version and the normalized params."""
+        normalized = '&'.join(f'{k}={params[k]}' for k in sorted(params) if params[k] not in (None, ''))
+        return ':'.join([namespace, f'v{self.backend.version(namespace)}', *map(str, parts), normalized])
+
+    def get_or_load(self, key, loader):
+        entry = self.backend.get(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.time() - stored_at
+            if age < self.ttl:
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self._refresh_in_background(key, loader)
+                return value
+        value = loader()
+        if self.should_store(key):
+            self.backend.set(key, value)
+        return value
+
+    def _refresh_in_background(self, key, loader):
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self.backend.set(key, self.run_refresh(loader))
+            except Exception:
+                # Keep serving the stale entry; the next request retries
+                pass
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(refresh)
+
+    def invalidate(self, namespace):
+        self.backend.bump(namespace)
+
+    def invalidated_at(self, key):
+        """When the namespace of `key` was last invalidated (0 if never)."""
+        return self.backend.bumped_at(key.split(':', 1)[0])
+
+
+def backend_from_env(max_age):
+    """Picks the cache backend from RESPONSE_CACHE_BACKEND (memory or sqlite)."""
+    if os.getenv('RESPONSE_CACHE_BACKEND', 'memory') == 'sqlite':
+        return SQLiteCache(os.getenv('RESPONSE_CACHE_PATH', 'response_cache.db'), max_age=max_age)
+    return LRUCache(maxsize=int(os.getenv('RESPONSE_CACHE_SIZE', 1024)), max_age=max_age)
@@ -0,0 +1,127 @@
+# check_query_plans.py - RUN THIS SCRIPT SEPARATELY
+# Calls the main read and write routes against a seeded database, records
+# every statement they run and EXPLAINs it. Exits non-zero if any plan scans
+# a whole table that isn't allowed below, so a dropped or unused index
+# shows up before it reaches production.
+# Usage: python check_query_plans.py
+#        DATABASE_URL=postgresql://... python check_query_plans.py   (scratch DB only: it seeds rows)
+import os
+import re
+import sys
+from decimal import Decimal
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ['RATE_LIMITS_ENABLED'] = '0'
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+from app import app, db, User, Category, Product, CartItem, Order, OrderItem
+
+# Scans that are expected, per route: leading-wildcard ILIKE can't use a
+# b-tree index, and unfiltered aggregates touch every row by definition.
+ALLOWED_SCANS = {
+    'list products': {'products'},
+    'list products by category name': {'categories', 'products'},
+    'search products': {'products'},
+    'list categories': {'categories'},
+}
+
+# SQLite: "SCAN products" (no USING INDEX); Postgres: "Seq Scan on products"
+FULL_SCAN = re.compile(r'^\s*(?:SCAN (\w+)(?!.*USING)|.*Seq Scan on (\w+))')
+
+
+def seed():
+    db.create_all()
+    user = User(username='plans', email='plans@example.com', password_hash='x')
+    categories = [Category(name=f'plans-{i}') for i in range(5)]
+    db.session.add_all([user, *categories])
+    db.session.flush()
+    products = [Product(user_id=user.id, category_id=categories[i % 5].id, title=f'Plan product {i}',
+                        price=Decimal('9.99')) for i in range(50)]
+    db.session.add_all(products)
+    db.session.flush()
+    db.session.add(CartItem(user_id=user.id, product_id=products[0].id, quantity=1))
+    order = Order(user_id=user.id, total_amount=Decimal('9.99'))
+    order.items.append(OrderItem(product_id=products[1].id, quantity=1, price=Decimal('9.99')))
+    db.session.add(order)
+    db.session.commit()
+    return user, categories[0], products
+
+
+def explain(conn, statement, parameters):
+    dialect = db.engine.dialect.name
+    cursor = conn.cursor()
+    if dialect == 'postgresql':
+        # Seq scans only win when there is no usable index at all
+        cursor.execute('SET enable_seqscan = off')
+        cursor.execute('EXPLAIN ' + statement, parameters)
+        return [row[0] for row in cursor.fetchall()]
+    cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+    return [row[-1] for row in cursor.fetchall()]
+
+
+def main():
+    with app.app_context():
+        user, category, products = seed()
+        token = create_access_token(identity=str(user.id))
+    headers = {'Authorization': f'Bearer {token}'}
+
+    calls = [
+        ('list products', 'GET', '/api/products', {}),
+        ('list products by category', 'GET', f'/api/products?category={category.id}', {}),
+        ('list products by category name', 'GET', f'/api/products?category={category.name}', {}),
+        ('search products', 'GET', '/api/products?keyword=plan', {}),
+        ('batch products', 'GET', f'/api/products?ids={products[0].id},{products[1].id}', {}),
+        ('get product', 'GET', f'/api/products/{products[2].id}', {}),
+        ('update product', 'PUT', f'/api/products/{products[2].id}', {'json': {'price': '10.50'}}),
+        ('list categories', 'GET', '/api/categories', {}),
+        ('profile', 'GET', '/api/users/me', {}),
+        ('get cart', 'GET', '/api/cart', {}),
+        ('add to cart', 'POST', '/api/cart', {'json': {'product_id': products[3].id}}),
+        ('list orders', 'GET', '/api/orders', {}),
+    ]
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and re.match(r'\s*(SELECT|WITH|UPDATE|DELETE|INSERT .* SELECT)', statement, re.S | re.I):
+            statements.append((statement, parameters))
+
+    client = app.test_client()
+    failures = 0
+    for label, method, path, kwargs in calls:
+        statements.clear()
+        failed_before = failures
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                response = client.open(path, method=method, headers=headers, **kwargs)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+            if response.status_code >= 400:
+                print(f'ERROR {label}: {method} {path} returned {response.status_code}')
+                failures += 1
+                continue
+
+            conn = db.engine.raw_connection()
+            try:
+                for statement, parameters in statements:
+                    plan = explain(conn, statement, parameters)
+                    scanned = {t for line in plan for m in [FULL_SCAN.match(line)] if m for t in m.groups() if t}
+                    unexpected = scanned - ALLOWED_SCANS.get(label, set())
+                    if unexpected:
+                        failures += 1
+                        print(f'FAIL  {label}: full scan of {", ".join(sorted(unexpected))}')
+                        print('      ' + ' '.join(statement.split()))
+                        print('      ' + '\n      '.join(plan))
+            finally:
+                conn.rollback()
+                conn.close()
+        if failures == failed_before:
+            print(f'ok    {label}: {len(statements)} statements')
+
+    print(f'{failures} problem(s)' if failures else 'all query plans use indexes')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+# check_routes.py - RUN THIS SCRIPT SEPARATELY
+# Behaviour checks for the API against a seeded in-memory SQLite DB: each
+# check drives the routes through the test client and returns a list of
+# problems. Exits non-zero if any check finds one. The read replica is a
+# second in-memory DB that never receives writes, i.e. one that lags
+# forever, so any read-your-writes gap shows up as missing data.
+# Usage: python check_routes.py
+import os
+import sys
+import time
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['DATABASE_REPLICA_URL'] = 'sqlite://'
+os.environ['RATE_LIMITS_ENABLED'] = '0'
+os.environ['BCRYPT_LOG_ROUNDS'] = '4'
+from sqlalchemy import event
+from werkzeug.http import http_date
+from app import app, db, Category, rate_limiter
+
+client = app.test_client()
+
+
+def traced(method, path, **kwargs):
+    """Calls a route, returning the response and the SQL it ran, with COMMIT markers."""
+    trace = []
+
+    def statement(conn, cursor, sql, parameters, context, executemany):
+        trace.append(sql.split(None, 1)[0].upper())
+
+    def commit(conn):
+        trace.append('COMMIT')
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', statement)
+        event.listen(db.engine, 'commit', commit)
+        try:
+            response = client.open(path, method=method, **kwargs)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', statement)
+            event.remove(db.engine, 'commit', commit)
+    return response, trace
+
+
+def reads_after_commit(trace):
+    """SELECTs run after the last commit, i.e. reloading what was just written."""
+    tail = trace[len(trace) - trace[::-1].index('COMMIT'):] if 'COMMIT' in trace else []
+    return [sql for sql in tail if sql == 'SELECT']
+
+
+def register(name):
+    response = client.post('/api/auth/register',
+                           json={'username': name, 'email': f'{name}@example.com', 'password': 'secret'})
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+
+def check_profile_after_update():
+    headers = register('profile')
+    client.get('/api/users/me', headers=headers)  # warm the identity cache
+    client.put('/api/users/me', json={'username': 'renamed'}, headers=headers)
+    username = client.get('/api/users/me', headers=headers).get_json()['username']
+    return [] if username == 'renamed' else [f'profile still shows {username!r} after an update']
+
+
+def check_writes_skip_reload():
+    # Write endpoints build responses from RETURNING rows or the objects they
+    # just wrote, so nothing is selected again after the commit
+    problems = []
+    response, trace = traced('POST', '/api/auth/register',
+                             json={'username': 'writer', 'email': 'writer@example.com', 'password': 'secret'})
+    headers = {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+    user_id = response.get_json()['user']['id']
+    steps = [('register', response, trace)]
+
+    response, trace = traced('POST', '/api/products', headers=headers,
+                             json={'title': 'Lamp', 'category_id': '1', 'price': '27.49'})
+    product = response.get_json()['product']
+    steps.append(('create_product', response, trace))
+    if (product['user_id'], product['category_id'], product['price']) != (user_id, 1, 27.49):
+        problems.append(f'create_product echoed request types: {product}')
+
+    response, trace = traced('POST', '/api/cart', headers=headers, json={'product_id': product['id'], 'quantity': 2})
+    steps.append(('add_to_cart', response, trace))
+    if response.get_json()['cart_item']['user_id'] != user_id:
+        problems.append(f"add_to_cart returned user_id {response.get_json()['cart_item']['user_id']!r}")
+
+    response, trace = traced('POST', '/api/orders', headers=headers)
+    order = response.get_json()['order']
+    steps.append(('create_order', response, trace))
+    if (order['user_id'], order['total_amount']) != (user_id, 54.98):
+        problems.append(f"create_order returned user_id {order['user_id']!r}, total {order['total_amount']!r}")
+
+    for name, response, trace in steps:
+        if response.status_code >= 400:
+            problems.append(f'{name} returned {response.status_code}')
+        elif reads_after_commit(trace):
+            problems.append(f'{name} ran {len(reads_after_commit(trace))} SELECT(s) after committing')
+    return problems
+
+
+def check_listing_cache():
+    # A warm listing is served without touching the database, and a write
+    # still shows up on the next request
+    problems = []
+    headers = register('lister')
+    client.get('/api/products')
+    response, trace = traced('GET', '/api/products')
+    if trace:
+        problems.append(f'warm listing ran {len(trace)} statement(s): {trace}')
+    before = response.get_json()['total']
+    client.post('/api/products', headers=headers, json={'title': 'Chair', 'category_id': 1, 'price': '5.00'})
+    after = client.get('/api/products').get_json()['total']
+    if after != before + 1:
+        problems.append(f'listing total went from {before} to {after} after a create')
+    return problems
+
+
+def check_listing_after_delete():
+    # Deleting a product changes max(id) or count but not max(updated_at),
+    # so a date-only conditional request must not get a 304
+    problems = []
+    headers = register('deleter')
+    product = client.post('/api/products', headers=headers,
+                          json={'title': 'Stool', 'category_id': 1, 'price': '12.00'}).get_json()['product']
+    first = client.get('/api/products')
+    client.delete(f"/api/products/{product['id']}", headers=headers)
+    since = first.headers.get('Last-Modified') or http_date(time.time())
+    response = client.get('/api/products', headers={'If-Modified-Since': since})
+    if response.status_code == 304:
+        problems.append('If-Modified-Since got a 304 after a delete')
+    elif response.get_json()['total'] != first.get_json()['total'] - 1:
+        problems.append('listing total did not drop after a delete')
+    return problems
+
+
+def check_delete_product_in_cart():
+    # Deleting a product someone has in their cart clears it from the cart
+    problems = []
+    seller, buyer = register('seller'), register('buyer')
+    product = client.post('/api/products', headers=seller,
+                          json={'title': 'Vase', 'category_id': 1, 'price': '3.00'}).get_json()['product']
+    client.post('/api/cart', headers=buyer, json={'product_id': product['id']})
+    response = client.delete(f"/api/products/{product['id']}", headers=seller)
+    if response.status_code != 200:
+        problems.append(f'delete_product returned {response.status_code}: {response.get_json()}')
+    cart = client.get('/api/cart', headers=buyer).get_json()
+    if cart:
+        problems.append(f"buyer's cart still holds {len(cart)} item(s)")
+    return problems
+
+
+def check_bulk_update_validation():
+    headers = register('bulk')
+    product = client.post('/api/products', headers=headers,
+                          json={'title': 'Rug', 'category_id': 1, 'price': '99999999.00'}).get_json()['product']
+    problems = []
+    for body in ({'price': '100000000'}, {'price': -1}):
+        response = client.post('/api/products/bulk_update', headers=headers, json={'ids': [product['id']], **body})
+        if response.status_code != 400:
+            problems.append(f'bulk_update with {body} returned {response.status_code}')
+    for body in ({'category_id': [1]}, {'category_id': 'x'}):
+        response = client.post('/api/products/bulk_update', headers=headers, json={'ids': [product['id']], **body})
+        if response.status_code != 400 or response.get_json()['message'] != 'category_id must be an integer':
+            problems.append(f'bulk_update with {body} returned {response.status_code}: {response.get_json()}')
+    for body in ({'price_delta': 1}, {'price_percent': 50}):
+        response = client.post('/api/products/bulk_update', headers=headers, json={'ids': [product['id']], **body})
+        if response.status_code != 200 or response.get_json()['updated_ids']:
+            problems.append(f'bulk_update with {body} pushed the price out of range')
+    return problems
+
+
+def check_read_your_writes_without_cookies():
+    # API clients that keep no cookies are recognised by their token
+    problems = []
+    api = app.test_client(use_cookies=False)
+    response = api.post('/api/auth/register',
+                        json={'username': 'api', 'email': 'api@example.com', 'password': 'secret'})
+    headers = {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+    product = api.post('/api/products', headers=headers,
+                       json={'title': 'Desk', 'category_id': 1, 'price': '80.00'}).get_json()['product']
+    response = api.get(f"/api/products/{product['id']}", headers=headers)
+    if response.status_code != 200:
+        problems.append(f'get_product right after a create returned {response.status_code}')
+    items = api.get(f"/api/products?ids={product['id']}", headers=headers).get_json()['items']
+    if len(items) != 1:
+        problems.append(f'batch lookup right after a create returned {len(items)} item(s)')
+    return problems
+
+
+def check_login_lockout():
+    # Failed logins from one address must not lock the account out elsewhere
+    problems = []
+    register('victim')
+    attacker, owner = {'REMOTE_ADDR': '10.0.0.1'}, {'REMOTE_ADDR': '10.0.0.2'}
+    rate_limiter.enabled = True
+    try:
+        statuses = [client.post('/api/auth/login', environ_base=attacker,
+                                json={'email': 'victim@example.com', 'password': 'wrong'}).status_code
+                    for _ in range(12)]
+        if 429 not in statuses:
+            problems.append('12 failed logins from one address were never limited')
+        response = client.post('/api/auth/login', environ_base=owner,
+                               json={'email': 'Victim@example.com', 'password': 'secret'})
+        if response.status_code != 200:
+            problems.append(f'owner login from another address returned {response.status_code}')
+    finally:
+        rate_limiter.enabled = False
+    return problems
+
+
+CHECKS = [
+    check_profile_after_update,
+    check_writes_skip_reload,
+    check_listing_cache,
+    check_listing_after_delete,
+    check_delete_product_in_cart,
+    check_bulk_update_validation,
+    check_read_your_writes_without_cookies,
+    check_login_lockout,
+]
+
+
+def main():
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(db.engines['replica'])
+        db.session.add(Category(name='check'))
+        db.session.commit()
+
+    failures = 0
+    for check in CHECKS:
+        problems = check()
+        failures += len(problems)
+        print(f"{'FAIL' if problems else 'ok  '}  {check.__name__}")
+        for problem in problems:
+            print(f'      {problem}')
+
+    print(f'{failures} problem(s)' if failures else 'all checks passed')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
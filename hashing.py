@@ -0,0 +1,98 @@
+# hashing.py
+# bcrypt is deliberately slow, so hashing and checking run in a small
+# process pool instead of on the request thread. The pool has a bounded
+# queue: when it is full, callers get HashingBusy right away instead of
+# piling up behind a login storm.
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+import bcrypt
+
+# bcrypt only uses the first 72 bytes of a password; newer releases raise
+# instead of truncating, so truncate explicitly to keep old hashes valid.
+MAX_PASSWORD_BYTES = 72
+
+
+class HashingBusy(Exception):
+    """The hashing queue is full or a job timed out."""
+
+
+def _encode(password):
+    return password.encode('utf-8')[:MAX_PASSWORD_BYTES]
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(_encode(password), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(pw_hash, password):
+    return bcrypt.checkpw(_encode(password), pw_hash.encode('utf-8'))
+
+
+def hash_rounds(pw_hash):
+    """The cost factor stored in a bcrypt hash ($2b$<rounds>$...)."""
+    return int(pw_hash.split('$')[2])
+
+
+class PasswordHasher:
+    def __init__(self, rounds=12, workers=2, max_queue=32, timeout=10):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def _pool(self):
+        if self._executor is None:
+            # By the first hash the server is running request and background
+            # threads, and forking a multi-threaded process can deadlock the
+            # child, so workers come from a forkserver (spawn where there's none)
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context(method))
+        return self._executor
+
+    def _done(self, future):
+        with self._lock:
+            self._in_flight -= 1
+            self._completed += 1
+
+    def _run(self, fn, *args):
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self._rejected += 1
+                raise HashingBusy('password hashing queue is full')
+            self._in_flight += 1
+            future = self._pool().submit(fn, *args)
+        future.add_done_callback(self._done)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HashingBusy('password hashing timed out')
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, pw_hash, password):
+        return self._run(_check, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """True when the hash was made with a different cost factor."""
+        return hash_rounds(pw_hash) != self.rounds
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'rounds': self.rounds,
+                'in_flight': self._in_flight,
+                'queued': max(0, self._in_flight - self.workers),
+                'max_queue': self.max_queue,
+                'completed': self._completed,
+                'rejected': self._rejected
+            }
@@ -0,0 +1,129 @@
+# ratelimit.py
+# Token-bucket rate limiting for expensive endpoints. A rule like "5/minute"
+# refills 5 tokens per minute into a bucket that holds at most 5 (or
+# `burst`); each request takes one token and is refused when none are left.
+import os
+import sqlite3
+import threading
+import time
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__('rate limit exceeded')
+        self.retry_after = retry_after
+
+
+def parse_rule(rule):
+    """Parses "N/period" or "N/period burst B" into (tokens per second, capacity)."""
+    parts = rule.split()
+    count, period = parts[0].split('/')
+    capacity = int(parts[2]) if len(parts) == 3 and parts[1] == 'burst' else int(count)
+    return int(count) / PERIODS[period.rstrip('s')], capacity
+
+
+def _refill(tokens, updated_at, rate, capacity, now):
+    return min(capacity, tokens + (now - updated_at) * rate)
+
+
+class MemoryBucketStore:
+    """
+    Buckets live in a plain dict of immutable (tokens, updated_at) tuples.
+    A bucket is read and replaced with single dict operations, which are
+    atomic under the GIL, so no lock is taken on the request path. Two
+    racing requests can both read the same bucket, which at worst lets one
+    extra request through.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}
+
+    def take(self, key, rate, capacity):
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (capacity, now))
+        tokens = _refill(tokens, updated_at, rate, capacity, now)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+        self._buckets[key] = (tokens - 1, now)
+        if len(self._buckets) > self.max_keys:
+            self._prune(now)
+        return 0
+
+    def _prune(self, now):
+        # Drop buckets idle for an hour; they would be full again anyway
+        for key, (_, updated_at) in list(self._buckets.items()):
+            if now - updated_at > 3600:
+                self._buckets.pop(key, None)
+
+
+class SQLiteBucketStore:
+    """Buckets in a local SQLite file, shared by all worker processes on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute(
+            'CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated_at REAL)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, capacity):
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = _refill(*(row or (capacity, now)), rate, capacity, now)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                         (key, tokens - 1 if not wait else tokens, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+
+class RateLimiter:
+    """
+    Applies named rules to a store. `overrides` maps rule names to rule
+    strings (or "off") and takes precedence over the defaults in code.
+    """
+
+    def __init__(self, store, overrides=None, enabled=True):
+        self.store = store
+        self.overrides = overrides or {}
+        self.enabled = enabled
+
+    def hit(self, name, default_rule, keys):
+        """Takes a token from each key's bucket; raises RateLimited if any is empty."""
+        rule = self.overrides.get(name, default_rule)
+        if not self.enabled or rule == 'off':
+            return
+        rate, capacity = parse_rule(rule)
+        wait = max((self.store.take(f'{name}:{key}', rate, capacity) for key in keys), default=0)
+        if wait:
+            raise RateLimited(retry_after=wait)
+
+
+def limiter_from_env():
+    """
+    RATE_LIMIT_BACKEND picks memory or sqlite (RATE_LIMIT_PATH), and
+    RATE_LIMITS overrides rules, e.g. "login=10/minute;search=off".
+    """
+    if os.getenv('RATE_LIMIT_BACKEND', 'memory') == 'sqlite':
+        store = SQLiteBucketStore(os.getenv('RATE_LIMIT_PATH', 'rate_limits.db'))
+    else:
+        store = MemoryBucketStore()
+    overrides = dict(item.split('=', 1) for item in os.getenv('RATE_LIMITS', '').split(';') if '=' in item)
+    return RateLimiter(store, overrides, enabled=os.getenv('RATE_LIMITS_ENABLED', '1') == '1')
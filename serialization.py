@@ -0,0 +1,93 @@
+# serialization.py
+# JSON encoding for large list responses. Rows selected as plain tuples are
+# encoded with orjson when it is installed, falling back to the stdlib. The
+# output matches Flask's jsonify byte for byte: sorted keys, ASCII-only,
+# compact or 2-space indented depending on the app's JSON settings.
+import json
+import re
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import islice
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+# Everything the stdlib escapes under ensure_ascii that orjson leaves as is
+_NON_ASCII = re.compile('[\x7f-\U0010ffff]')
+
+
+def _default(o):
+    # Numeric columns serialize as floats and datetimes as ISO 8601,
+    # like the models' to_dict methods
+    if isinstance(o, Decimal):
+        return float(o)
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+def _escape(match):
+    code = ord(match.group())
+    if code > 0xFFFF:
+        code -= 0x10000
+        return '\\u{:04x}\\u{:04x}'.format(0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF))
+    return '\\u{:04x}'.format(code)
+
+
+def dumps(obj, sort_keys=True, indent=None, ensure_ascii=True):
+    """
+    Encodes `obj` the way json.dumps(obj, sort_keys=..., indent=...,
+    ensure_ascii=...) would with compact separators when indent is None,
+    but handles Decimal and datetime values.
+    """
+    if orjson is not None and indent in (None, 2):
+        option = orjson.OPT_PASSTHROUGH_DATETIME
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        out = orjson.dumps(obj, default=_default, option=option).decode('utf-8')
+        if ensure_ascii and (not out.isascii() or '\x7f' in out):
+            out = _NON_ASCII.sub(_escape, out)
+        return out
+
+    separators = None if indent else (',', ':')
+    return json.dumps(obj, default=_default, sort_keys=sort_keys, indent=indent,
+                      separators=separators, ensure_ascii=ensure_ascii)
+
+
+def response_body(app, obj):
+    """The body jsonify(obj) would produce under `app`'s JSON settings."""
+    provider = app.json
+    pretty = (getattr(provider, 'compact', None) is None and app.debug) or getattr(provider, 'compact', None) is False
+    return dumps(obj,
+                 sort_keys=getattr(provider, 'sort_keys', True),
+                 indent=2 if pretty else None,
+                 ensure_ascii=getattr(provider, 'ensure_ascii', True)) + '\n'
+
+
+def json_response(app, obj, status=200):
+    return app.response_class(response_body(app, obj), status=status, mimetype=app.json.mimetype)
+
+
+def stream_json(objects, fmt='ndjson', batch_size=1000, sort_keys=True):
+    """
+    Yields an iterable of objects as NDJSON lines or as the pieces of one
+    JSON array, `batch_size` objects per chunk, so nothing but the current
+    batch is held in memory.
+    """
+    objects = iter(objects)
+    batches = iter(lambda: list(islice(objects, batch_size)), [])
+    if fmt == 'ndjson':
+        for batch in batches:
+            yield ''.join(dumps(obj, sort_keys=sort_keys) + '\n' for obj in batch)
+        return
+
+    yield '['
+    separator = ''
+    for batch in batches:
+        yield separator + ','.join(dumps(obj, sort_keys=sort_keys) for obj in batch)
+        separator = ','
+    yield ']\n'
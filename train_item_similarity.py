@@ -0,0 +1,22 @@
+# train_item_similarity.py - RUN THIS SCRIPT SEPARATELY
+# Builds the item-item similarity table from co-purchases (items in the same
+# order) and co-cart data (items in the same user's cart), and saves it where
+# ai_agents.py loads it at startup.
+import pandas as pd
+from app import app, db, Order, OrderItem, CartItem
+from ai_agents import build_item_similarity, save_item_similarity, ITEM_SIMILARITY_DIR, PURCHASE_SCORE, CART_SCORE
+
+with app.app_context():
+    order_lines = db.session.query(OrderItem.order_id, OrderItem.product_id).all()
+    cart_lines = db.session.query(CartItem.user_id, CartItem.product_id).all()
+
+# Each order and each cart is one basket; purchases weigh more than cart adds
+rows = [(f'order-{o}', p, PURCHASE_SCORE) for o, p in order_lines] + \
+       [(f'cart-{u}', p, CART_SCORE) for u, p in cart_lines]
+baskets = pd.DataFrame(rows, columns=['user_id', 'product_id', 'score'])
+baskets = baskets.groupby(['user_id', 'product_id'], as_index=False)['score'].sum()
+
+table = build_item_similarity(baskets)
+save_item_similarity(table)
+print(f"Saved similarities for {len(table['product_ids'])} products "
+      f"({table['similarity'].nnz} pairs) to {ITEM_SIMILARITY_DIR}")
@@ -0,0 +1,24 @@
+# train_mf.py - RUN THIS SCRIPT SEPARATELY
+# Trains the ALS recommender on purchases and cart adds and saves the
+# factor matrices that ai_agents.py memory-maps at startup.
+import pandas as pd
+from app import app, db, Order, OrderItem, CartItem
+from ai_agents import train_als, save_factor_model, MF_FACTORS_DIR
+
+# Purchases count for more than items that only sat in a cart
+PURCHASE_WEIGHT = 5
+CART_WEIGHT = 2
+
+with app.app_context():
+    purchases = db.session.query(Order.user_id, OrderItem.product_id, OrderItem.quantity) \
+        .join(OrderItem, OrderItem.order_id == Order.id).all()
+    cart_adds = db.session.query(CartItem.user_id, CartItem.product_id, CartItem.quantity).all()
+
+rows = [(u, p, PURCHASE_WEIGHT * q) for u, p, q in purchases] + \
+       [(u, p, CART_WEIGHT * q) for u, p, q in cart_adds]
+interactions = pd.DataFrame(rows, columns=['user_id', 'product_id', 'score'])
+interactions = interactions.groupby(['user_id', 'product_id'], as_index=False)['score'].sum()
+
+model = train_als(interactions)
+save_factor_model(model)
+print(f"Saved factors for {len(model['user_ids'])} users and {len(model['product_ids'])} products to {MF_FACTORS_DIR}")